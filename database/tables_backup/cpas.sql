@@ -81,6 +81,11 @@ CREATE TABLE IF NOT EXISTS cpa_chemical_aliases (
 CREATE UNIQUE INDEX IF NOT EXISTS uq_alias_global
     ON cpa_chemical_aliases (alias);
 
+-- ANN index for the nearest-alias `<->` queries (halfvec: vector indexes stop at 2000 dims)
+CREATE INDEX IF NOT EXISTS idx_alias_embedding_ann
+    ON cpa_chemical_aliases
+ USING hnsw ((embedding::halfvec(3072)) halfvec_l2_ops);
+
 
 CREATE TABLE IF NOT EXISTS cpa_chemicals (
   id             UUID        PRIMARY KEY DEFAULT uuid_generate_v4(),
@@ -191,3 +196,8 @@ CREATE EXTENSION IF NOT EXISTS citext;
 ALTER TABLE cpa_chemicals
   ALTER COLUMN preferred_name TYPE citext;
 
+-- Arbiter for the `ON CONFLICT (preferred_name)` upserts in merge_agents and
+-- cpa_ingest; on citext it is case-insensitive, so concurrent workers that
+-- both miss the ANN lookup converge on one row instead of two.
+CREATE UNIQUE INDEX IF NOT EXISTS uq_chem_preferred_name
+  ON cpa_chemicals (preferred_name);
@@ -63,6 +63,10 @@ CREATE TABLE IF NOT EXISTS cpa_chemicals (
   CHECK (inchikey IS NULL OR inchikey ~* '^[A-Z]{14}-[A-Z]{10}-[A-Z]$')
 );
 
+/* arbiter for the ON CONFLICT (preferred_name) upserts */
+CREATE UNIQUE INDEX IF NOT EXISTS uq_chem_preferred_name
+    ON cpa_chemicals (preferred_name);
+
 /* auto‑update updated_at */
 CREATE OR REPLACE FUNCTION _touch_updated_at()
 RETURNS TRIGGER
@@ -87,11 +91,14 @@ CREATE TABLE IF NOT EXISTS cpa_chemical_aliases (
 CREATE UNIQUE INDEX IF NOT EXISTS uq_alias_global
     ON cpa_chemical_aliases (alias);
 
-/* ANN index for similarity search (vector cosine distance) */
+/* ANN index for similarity search (L2 distance, matches the `<->` queries;
+   a cosine-ops index is never chosen for `ORDER BY embedding <-> ...`).
+   pgvector indexes `vector` only up to 2 000 dims, so the 3 072-dim column is
+   indexed as halfvec; queries order by the same expression:
+     ORDER BY embedding::halfvec(3072) <-> $1::vector::halfvec(3072)      */
 CREATE INDEX IF NOT EXISTS idx_alias_embedding_ann
     ON cpa_chemical_aliases
- USING ivfflat (embedding vector_cosine_ops)
-  WITH (lists = 100);
+ USING hnsw ((embedding::halfvec(3072)) halfvec_l2_ops);
 
 --------------------------------------------------------------------
 -- 4. Agent‑property tables  (your insert_agent_properties helper)
@@ -187,6 +194,15 @@ CREATE TABLE IF NOT EXISTS cpa_unverified_inchikeys (
   logged_at    TIMESTAMPTZ DEFAULT now()
 );
 
+/* Persistent embedding cache (EMBEDDING_DB_CACHE=1);
+   key = sha1(model || '\0' || canonical text) */
+CREATE TABLE IF NOT EXISTS embedding_cache (
+  key        BYTEA        PRIMARY KEY,
+  model      TEXT         NOT NULL,
+  embedding  vector(3072) NOT NULL,
+  created_at TIMESTAMPTZ  DEFAULT now()
+);
+
 COMMIT;
 
 -- add a per‑paper deterministic ID to experiments
@@ -201,12 +217,12 @@ ALTER TABLE experiments
 /* ════════════════════════════════════════════════════════════════
    Post‑installation notes
    ----------------------------------------------------------------
-   • The ANN index (ivfflat) needs `SET enable_seqscan = off;`
-     or `SET ivfflat.probes` session parameter for best performance
-     during similarity search.
+   • The ANN index (HNSW over halfvec, pgvector ≥ 0.7) needs no session
+     settings: the default `hnsw.ef_search = 40` is ample for the
+     LIMIT 1 nearest-alias lookups.
    • If you use an embedding dimension other than 3 072, adjust the
-     `vector(3072)` declarations in *both* tables and rebuild the
-     ivfflat index.
+     `vector(3072)` declarations in *both* tables, the halfvec casts in
+     the nearest-alias queries, and rebuild the HNSW index.
    • Nothing else (functions, triggers) is required because all
      upsert / dedup logic lives in Python.
    ════════════════════════════════════════════════════════════════ */
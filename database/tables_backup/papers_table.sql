@@ -31,6 +31,7 @@ CREATE TABLE papers (
   license          TEXT,
 
   md5_hash         CHAR(32),
+  content_hash     CHAR(32),
   file_size_bytes  INTEGER,
   file_s3_uri       TEXT,
   fulltext_s3_uri   TEXT,
@@ -40,4 +41,15 @@ CREATE TABLE papers (
 );
 
 -- Uniqueness only on md5_hash (ignores NULL)
-CREATE UNIQUE INDEX ux_papers_md5_hash ON papers(md5_hash) WHERE md5_hash IS NOT NULL;
\ No newline at end of file
+CREATE UNIQUE INDEX ux_papers_md5_hash ON papers(md5_hash) WHERE md5_hash IS NOT NULL;
+CREATE UNIQUE INDEX ux_papers_content_hash ON papers(content_hash) WHERE content_hash IS NOT NULL;
+
+-- LLM response cache: one validated extraction per (paper text, model, prompt/schema revision)
+CREATE TABLE IF NOT EXISTS llm_extraction_cache (
+  content_sha256  CHAR(64)    NOT NULL,
+  model           TEXT        NOT NULL,
+  schema_version  TEXT        NOT NULL,
+  result          JSONB       NOT NULL,
+  created_at      TIMESTAMPTZ NOT NULL DEFAULT now(),
+  PRIMARY KEY (content_sha256, model, schema_version)
+);
@@ -1,10 +1,9 @@
 import os
-import requests
 import tempfile
 from llama_cloud_services import LlamaParse
 from distiller.utils.s3_utils import (
+    download_file_from_s3,
     get_s3_object_key,
-    get_s3_presigned_url,
 )
 
 _S3_TARGET_BUCKET = os.getenv("S3_TARGET_BUCKET")
@@ -20,13 +19,8 @@ def extract_text_from_s3(file_s3_uri: str):
     if not object_key:
         raise ValueError(f"No S3 object key found for {file_s3_uri}")
 
-    s3_presigned_url = get_s3_presigned_url(_S3_TARGET_BUCKET, object_key)
-
     with tempfile.NamedTemporaryFile(suffix=".pdf") as tmp_file:
-        response = requests.get(s3_presigned_url)
-        response.raise_for_status()
-        tmp_file.write(response.content)
-        tmp_file.flush()
+        download_file_from_s3(_S3_TARGET_BUCKET, object_key, tmp_file.name)
         parser = LlamaParse(
             api_key=_LLAMACLOUD_API_KEY,
             result_type="markdown",
@@ -1,10 +1,13 @@
 from __future__ import annotations
-import json, os
+import orjson, os
 from typing import Any, Dict
-import boto3, google.generativeai as genai
-from jsonschema import validate, ValidationError
+import google.generativeai as genai
 from ..postgres_connection import cursor_ctx
-from distiller.utils.file_utils import clean_json_response
+from distiller.utils.file_utils import clean_json_response, split_prompt_template
+from distiller.utils.s3_utils import GLOBAL_S3, read_s3_text
+from distiller.utils.concurrency import DEFAULT_MAX_WORKERS, run_bounded
+from distiller.utils.db_utils import get_cached_extraction, prompt_version, store_cached_extraction
+from distiller.utils.schema_utils import SchemaValidationError, compile_schema_validator
 
 _GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 if not _GEMINI_API_KEY:
@@ -21,13 +24,23 @@ SCHEMA_PATH = os.path.join(os.path.dirname(SCRIPT_DIR), "..", "schema.json")
 PROMPT_PATH = os.path.join(os.path.dirname(SCRIPT_DIR), "..", "gemini_prompt.txt")
 
 with open(SCHEMA_PATH) as fh:
-    SCHEMA_OBJ = json.load(fh)
-    SCHEMA_STR = json.dumps(SCHEMA_OBJ, indent=2)
+    SCHEMA_OBJ = orjson.loads(fh.read())
+    SCHEMA_STR = orjson.dumps(SCHEMA_OBJ, option=orjson.OPT_INDENT_2).decode()
+VALIDATE = compile_schema_validator(SCHEMA_OBJ)
 
 with open(PROMPT_PATH) as fh:
     PROMPT_TEMPLATE = fh.read()
 
-s3 = boto3.client("s3")
+PROMPT_PREFIX, PROMPT_SUFFIX = split_prompt_template(PROMPT_TEMPLATE, SCHEMA_STR)
+_GEMINI_MODEL = "gemini-2.5-pro"
+_PROMPT_VERSION = prompt_version(PROMPT_PREFIX, PROMPT_SUFFIX)
+_MODEL = genai.GenerativeModel(
+    _GEMINI_MODEL,
+    system_instruction=PROMPT_PREFIX,
+    generation_config={"response_mime_type": "application/json"},
+)
+
+s3 = GLOBAL_S3
 
 
 def _stream_s3_text(uri: str) -> str:
@@ -35,25 +48,53 @@ def _stream_s3_text(uri: str) -> str:
     if not uri.startswith(prefix):
         raise ValueError(f"URI must start with {prefix!r}")
     key = uri[len(prefix):]
-    return s3.get_object(Bucket=_S3_TARGET_BUCKET, Key=key)["Body"].read().decode()
+    return read_s3_text(s3, _S3_TARGET_BUCKET, key)
 
 def _extract(text: str) -> Dict[str, Any] | None:
-    prompt = PROMPT_TEMPLATE.replace("{{SCHEMA}}", SCHEMA_STR).replace("{{PAPER_TEXT}}", text)
+    cached = get_cached_extraction(text, _GEMINI_MODEL, _PROMPT_VERSION)
+    if cached is not None:
+        return cached
     try:
-        raw = genai.GenerativeModel("gemini-2.5-pro").generate_content(prompt).text
+        raw = _MODEL.generate_content(text + PROMPT_SUFFIX).text
     except Exception as e:
         print("[ERROR] Gemini API failed:", e); return None
 
     try:
-        data = json.loads(clean_json_response(raw))
-        validate(data, SCHEMA_OBJ)
+        data = orjson.loads(clean_json_response(raw))
+        VALIDATE(data)
+        store_cached_extraction(text, _GEMINI_MODEL, _PROMPT_VERSION, data)
         return data
-    except (json.JSONDecodeError, ValidationError) as e:
+    except (orjson.JSONDecodeError, *SchemaValidationError) as e:
         print("[ERROR] Gemini output bad:", e); return None
 
-def get_cpa_facts_from_fulltext(file_md5_hash: str | None = None, limit: int = 100) -> None:
+def _process_paper(paper_id: str, uri: str) -> tuple[str, Dict[str, Any] | None]:
+    print(f"[TRACE] Extracting CPAs from {uri} …")
+    return paper_id, _extract(_stream_s3_text(uri))
+
+def _store_results(cur, results: list[tuple[str, Dict[str, Any] | None]]) -> int:
+    """Queue every outcome of a batch on *cur*; the caller commits once. Returns the number COMPLETED."""
+    failed = [(paper_id,) for paper_id, parsed in results if not parsed]
+    completed = [(orjson.dumps(parsed).decode(), paper_id) for paper_id, parsed in results if parsed]
+    if failed:
+        cur.executemany("UPDATE papers SET status='FAILED' WHERE id=%s;", failed)
+    if completed:
+        cur.executemany(
+            "UPDATE papers SET cpa_facts_json=%s, status='COMPLETED' WHERE id=%s;",
+            completed,
+        )
+    return len(completed)
+
+def _commit_results(results: list[tuple[str, Dict[str, Any] | None]]) -> int:
+    """Write a batch's outcomes in one transaction on a fresh pooled connection."""
+    with cursor_ctx(commit=True) as cur:
+        return _store_results(cur, results)
+
+def get_cpa_facts_from_fulltext(
+    file_md5_hash: str | None = None, limit: int = 100, max_workers: int = DEFAULT_MAX_WORKERS
+) -> None:
+    # Short connections only: the SELECT up front and the UPDATEs at the end
+    # each take their own; none is held while Gemini runs.
     if not file_md5_hash:
-        
         with cursor_ctx() as cur:
             cur.execute(
                 """
@@ -71,23 +112,15 @@ def get_cpa_facts_from_fulltext(file_md5_hash: str | None = None, limit: int = 1
         if not rows:
             print("[TRACE] No pending papers."); return
 
-        done = 0
-        for paper_id, uri in rows:
-            print(f"[TRACE] Extracting CPAs from {uri} …")
-            parsed = _extract(_stream_s3_text(uri))
+        results = run_bounded(
+            _process_paper,
+            ((row["id"], row["fulltext_s3_uri"]) for row in rows),
+            max_workers,
+        )
+        for paper_id, parsed in results:
             if not parsed:
-                print("[WARN] Failed — marking FAILED")
-                with cursor_ctx(commit=True) as cur:
-                    cur.execute("UPDATE papers SET status='FAILED' WHERE id=%s;", (paper_id,))
-                continue
-
-            with cursor_ctx(commit=True) as cur:
-                cur.execute(
-                    "UPDATE papers SET cpa_facts_json=%s, status='COMPLETED' WHERE id=%s;",
-                    (json.dumps(parsed), paper_id),
-                )
-            done += 1
-            print("[TRACE] OK")
+                print(f"[WARN] Failed — marking FAILED ({paper_id})")
+        done = _commit_results(results)
 
         print(f"[TRACE] {done}/{len(rows)} papers updated.")
     else:
@@ -109,18 +142,7 @@ def get_cpa_facts_from_fulltext(file_md5_hash: str | None = None, limit: int = 1
             print(f"[TRACE] No pending paper found with md5_hash={file_md5_hash}.")
             return
 
-        paper_id, uri = row
-        print(f"[TRACE] Extracting CPAs from {uri} …")
-        parsed = _extract(_stream_s3_text(uri))
-        if not parsed:
+        if not _commit_results([_process_paper(row["id"], row["fulltext_s3_uri"])]):
             print("[WARN] Extraction failed; marking FAILED")
-            with cursor_ctx(commit=True) as cur:
-                cur.execute("UPDATE papers SET status='FAILED' WHERE id=%s;", (paper_id,))
             return
-
-        with cursor_ctx(commit=True) as cur:
-            cur.execute(
-                "UPDATE papers SET cpa_facts_json=%s, status='COMPLETED' WHERE id=%s;",
-                (json.dumps(parsed), paper_id),
-            )
-        print("[TRACE] Paper updated and marked COMPLETED.")
\ No newline at end of file
+        print("[TRACE] Paper updated and marked COMPLETED.")
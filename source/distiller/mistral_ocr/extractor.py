@@ -1,9 +1,12 @@
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from itertools import repeat
 from mistralai import Mistral
 from psycopg.errors import UniqueViolation
 from distiller.postgres_connection import connection_ctx
-from distiller.utils.file_utils import generate_md5
-from distiller.utils.db_utils import hash_in_psql
+from distiller.utils.file_utils import hash_files
+from distiller.utils.db_utils import existing_hashes
 from distiller.utils.s3_utils import upload_file_to_s3, upload_mistral_fulltext_to_s3, get_s3_object_key, get_s3_presigned_url
 from distiller.mistral_ocr.gpt_cpa_facts import get_cpa_facts_from_fulltext as get_cpa_facts_from_fulltext_gpt
 from distiller.mistral_ocr.update_metadata import update_metadata_from_fulltext
@@ -21,6 +24,10 @@ if not _MISTRAL_API_KEY:
 
 client = Mistral(api_key=_MISTRAL_API_KEY)
 
+_MAX_WORKERS = 16
+# S3 uploads may all run at once, but only a few OCR jobs go to Mistral concurrently.
+_OCR_SLOTS = threading.BoundedSemaphore(4)
+
 def extract_text_from_s3(file_s3_uri: str):
     """Generate Mistral OCR for the given file s3 uri(only pdf files) and return the Mistral full text."""
     object_key = get_s3_object_key(file_s3_uri)
@@ -39,66 +46,93 @@ def extract_text_from_s3(file_s3_uri: str):
 
 
 
-def extract_text_mistral(files: list[str], source_files :str):
+def _new_files(files: list[str]) -> dict[str, str]:
+    """Map MD5 -> file for the files not yet in psql, checked with a single query."""
+    by_hash: dict[str, str] = {}
+    for file, file_md5_hash in hash_files(files).items():
+        by_hash.setdefault(file_md5_hash, file)  # first copy wins within the batch
 
-    print(f"[TRACE][MISTRAL-OCR] Extracting full text from PDFs: {files}")
+    with connection_ctx() as conn, conn.cursor() as cur:
+        seen = existing_hashes(by_hash, cur)
+    for file_md5_hash in seen:
+        print(f"[TRACE] Skipping file {by_hash.pop(file_md5_hash)} as it is already in psql")
+    return by_hash
+
+
+def _process_file(file_md5_hash: str, file: str, source_files: str) -> None:
+    """OCR one file and register it; runs in a worker thread.
+
+    The worker's pooled connection covers the INSERT and the metadata update
+    (which may nest one LLM-cache lookup); it is released before the CPA pass.
+    """
     with connection_ctx() as conn:
         with conn.cursor() as cur:
-            for file in files:
-                try:
-                    file_md5_hash = generate_md5(file)
-
-                    if hash_in_psql(file_md5_hash, cur):
-                        print(f"[TRACE] Skipping file {file} as it is already in psql")
-                        continue
-
-                    s3_uri = upload_file_to_s3(file, object_key=f"raw/{file_md5_hash}.pdf")
-                    fulltext = extract_text_from_s3(s3_uri)
-                    fulltext_s3_uri = upload_mistral_fulltext_to_s3(fulltext, object_key = f"processed/{file_md5_hash}.txt")
-                    
-                    paper = Paper(
-                        source=source_files,
-                        md5_hash=file_md5_hash,
-                        file_s3_uri=s3_uri,
-                        fulltext_s3_uri=fulltext_s3_uri,
-                        file_size_bytes=os.path.getsize(file),
-                        status=PaperStatus.DOWNLOADED,
-                        created_at=datetime.now(),
-                    )
+            try:
+                s3_uri = upload_file_to_s3(file, object_key=f"raw/{file_md5_hash}.pdf")
+                with _OCR_SLOTS:
+                    ocr_response = extract_text_from_s3(s3_uri)
+                fulltext_s3_uri, fulltext = upload_mistral_fulltext_to_s3(ocr_response, object_key = f"processed/{file_md5_hash}.txt")
+                
+                paper = Paper(
+                    source=source_files,
+                    md5_hash=file_md5_hash,
+                    file_s3_uri=s3_uri,
+                    fulltext_s3_uri=fulltext_s3_uri,
+                    file_size_bytes=os.path.getsize(file),
+                    status=PaperStatus.DOWNLOADED,
+                    created_at=datetime.now(),
+                )
 
-                    cur.execute(
-                        """
-                        INSERT INTO papers (
-                            md5_hash,
-                            file_s3_uri,
-                            fulltext_s3_uri,
-                            file_size_bytes,
-                            status,
-                            source,
-                            created_at
-                        )
-                        VALUES (%s, %s, %s, %s, %s, %s, %s);
-                        """,
-                        (
-                            paper.md5_hash,
-                            paper.file_s3_uri,
-                            paper.fulltext_s3_uri,
-                            paper.file_size_bytes,
-                            paper.status.value,
-                            paper.source,
-                            paper.created_at,
-                        ),
+                cur.execute(
+                    """
+                    INSERT INTO papers (
+                        md5_hash,
+                        file_s3_uri,
+                        fulltext_s3_uri,
+                        file_size_bytes,
+                        status,
+                        source,
+                        created_at
                     )
-                    conn.commit()
-                    update_metadata_from_fulltext(paper.md5_hash, fulltext, source_files, cur)
-                    get_cpa_facts_from_fulltext_gpt(paper.md5_hash) # this step should be isolated later in order to achieve separation of concerns.
-                    
-                except UniqueViolation:
-                    # Do nothing on duplicate hash, just log and proceed
-                    conn.rollback()
-                    print(f"[TRACE] Duplicate md5_hash for {file}; skipping insert.")
-
-                except Exception as e:
-                    # Roll back any partial work in this iteration and continue with next file
-                    conn.rollback()
-                    print(f"[ERROR] Failed processing {file}: {e}")
+                    VALUES (%s, %s, %s, %s, %s, %s, %s);
+                    """,
+                    (
+                        paper.md5_hash,
+                        paper.file_s3_uri,
+                        paper.fulltext_s3_uri,
+                        paper.file_size_bytes,
+                        paper.status.value,
+                        paper.source,
+                        paper.created_at,
+                    ),
+                )
+                conn.commit()
+                update_metadata_from_fulltext(paper.md5_hash, fulltext, source_files, cur)
+
+            except UniqueViolation:
+                # Do nothing on duplicate hash, just log and proceed
+                conn.rollback()
+                print(f"[TRACE] Duplicate md5_hash for {file}; skipping insert.")
+                return
+
+            except Exception as e:
+                # Roll back any partial work for this file; other workers carry on
+                conn.rollback()
+                print(f"[ERROR] Failed processing {file}: {e}")
+                return
+
+    # Outside the block: the CPA pass takes its own short connections, so the
+    # worker's connection is back in the pool while the LLM runs.
+    try:
+        get_cpa_facts_from_fulltext_gpt(paper.md5_hash) # this step should be isolated later in order to achieve separation of concerns.
+    except Exception as e:
+        print(f"[ERROR] CPA extraction failed for {file}: {e}")
+
+
+def extract_text_mistral(files: list[str], source_files :str, max_workers: int = _MAX_WORKERS):
+
+    print(f"[TRACE][MISTRAL-OCR] Extracting full text from PDFs: {files}")
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        # list() drains the iterator so worker exceptions are not silently dropped
+        new_files = _new_files(files)
+        list(pool.map(_process_file, new_files.keys(), new_files.values(), repeat(source_files)))
@@ -1,13 +1,16 @@
 from __future__ import annotations
 
-import json
+import orjson
 import os
-import boto3
 from openai import OpenAI
 from pydantic import ValidationError
 
 from distiller.postgres_connection import cursor_ctx
-from distiller.utils.file_utils import clean_json_response
+from distiller.utils.file_utils import clean_json_response, split_prompt_template
+from distiller.utils.s3_utils import GLOBAL_S3, read_s3_text
+from distiller.utils.concurrency import DEFAULT_MAX_WORKERS, run_bounded
+from distiller.utils.db_utils import get_cached_extraction, prompt_version, store_cached_extraction
+from distiller.utils.schema_utils import model_json_schema
 from distiller.schemas.structured_output import CPAPaperData
 
 _OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
@@ -23,87 +26,104 @@ SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 PROMPT_PATH = os.path.join(os.path.dirname(SCRIPT_DIR), "..", "gpt_prompt.txt")
 
 client = OpenAI(api_key=_OPENAI_API_KEY)
-s3 = boto3.client("s3")
+s3 = GLOBAL_S3
 
 
 with open(PROMPT_PATH, encoding='utf-8') as fh:
     PROMPT_TEMPLATE = fh.read()  # Should contain {{PAPER_TEXT}} and {{SCHEMA}}
 
+# Serialised once so the prefix is byte-identical on every call (OpenAI prefix caching).
+SCHEMA_JSON = orjson.dumps(model_json_schema(CPAPaperData), option=orjson.OPT_INDENT_2).decode()
+PROMPT_PREFIX, PROMPT_SUFFIX = split_prompt_template(PROMPT_TEMPLATE, SCHEMA_JSON)
+_OPENAI_MODEL = "gpt-4.1-mini-2025-04-14"
+_PROMPT_VERSION = prompt_version(PROMPT_PREFIX, PROMPT_SUFFIX)
+# Schema-guided decoding, but not "strict": the free-form dict/union fields of
+# CPAPaperData are outside strict mode, so the schema is guidance only and an
+# invalid answer still gets one corrective retry with the validation errors.
+_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {"name": "cpa_paper_data", "schema": model_json_schema(CPAPaperData), "strict": False},
+}
+
 def _stream_s3_text(uri: str) -> str:
     prefix = f"s3://{_S3_TARGET_BUCKET}/"
     if not uri.startswith(prefix):
         raise ValueError(f"URI must start with {prefix!r}")
     key = uri[len(prefix):]
-    obj = s3.get_object(Bucket=_S3_TARGET_BUCKET, Key=key)
-    return obj["Body"].read().decode()
-
-def _build_prompt(paper_text: str) -> str:
-    schema_json = json.dumps(CPAPaperData.model_json_schema(), indent=2)
-    prompt = PROMPT_TEMPLATE.replace("{{PAPER_TEXT}}", paper_text)
-    prompt = prompt.replace("{{SCHEMA}}", schema_json)
-    return prompt
+    return read_s3_text(s3, _S3_TARGET_BUCKET, key)
+
+def _build_messages(paper_text: str) -> list[dict]:
+    return [
+        {"role": "system", "content": PROMPT_PREFIX},
+        {"role": "user", "content": paper_text + PROMPT_SUFFIX},
+    ]
+
+def _correction_request(err: Exception) -> str:
+    return (
+        "The JSON you provided did not pass validation. "
+        "Here are the problems:\n"
+        f"{err}\n"
+        "Please correct the JSON and return ONLY the corrected JSON object."
+    )
 
 def _extract(paper_text: str) -> dict | None:
-    """Send the extraction prompt and, if validation fails, give the
-    validation errors back to the model for one corrective attempt."""
-
-    base_prompt = _build_prompt(paper_text)
-    messages = [{"role": "user", "content": base_prompt}]
+    """Schema-guided call validated locally; one corrective retry on invalid output."""
 
-    for attempt in (1, 2):  # max two tries
+    cached = get_cached_extraction(paper_text, _OPENAI_MODEL, _PROMPT_VERSION)
+    if cached is not None:
+        return cached
+    messages = _build_messages(paper_text)
+    for attempt in (1, 2):  # one corrective retry: the schema is guidance, not enforced
         try:
             resp = client.chat.completions.create(
-                model="gpt-4.1-mini-2025-04-14",
+                model=_OPENAI_MODEL,
                 messages=messages,
                 temperature=0,
-                response_format={"type": "json_object"},
+                response_format=_RESPONSE_FORMAT,
             )
             raw = resp.choices[0].message.content
         except Exception as e:
             print("[ERROR] OpenAI API failed:", e)
             return None
 
-        # Clean and parse
-        content_str = raw if isinstance(raw, str) else json.dumps(raw)
-        if "clean_json_response" in globals():
-            content_str = clean_json_response(content_str)
-
         try:
-            data_dict = json.loads(content_str)
-        except json.JSONDecodeError as jerr:
-            # If JSON cannot even be parsed, treat as validation error path
-            data_dict = None
-            validation_exc = jerr
-        else:
-            try:
-                CPAPaperData.model_validate(data_dict)
-                # Success — return normalized JSON with aliases
-                return json.loads(
-                    CPAPaperData.model_validate(data_dict).model_dump_json(by_alias=True)
-                )
-            except ValidationError as verr:
-                validation_exc = verr
-
-        # If we reach here there was a validation / parsing problem.
-        if attempt == 1:
-            # Feed the errors back for a second attempt.
-            err_text = (
-                "The JSON you provided did not pass validation. "
-                "Here are the problems:\n"
-                f"{validation_exc}\n"
-                "Please correct the JSON and return ONLY the corrected JSON object."
-            )
-            # Record model's previous (invalid) answer so it has context
-            messages.append({"role": "assistant", "content": raw})
-            # Ask model to fix
-            messages.append({"role": "user", "content": err_text})
-            continue  # second loop iteration
-        else:
-            # Second attempt also failed
-            print("[ERROR] Validation/JSON error after retry:", validation_exc)
-            return None
-
-def get_cpa_facts_from_fulltext(file_md5_hash: str | None = None, limit: int = 100) -> None:
+            data_dict = orjson.loads(clean_json_response(raw or ""))
+            # Normalised, JSON-safe dict with aliases
+            result = CPAPaperData.model_validate(data_dict).model_dump(mode="json", by_alias=True)
+            break
+        except (orjson.JSONDecodeError, ValidationError) as e:
+            if attempt == 2:
+                print("[ERROR] Validation/JSON error after retry:", e)
+                return None
+            # Feed the errors back, with the invalid answer for context
+            messages = [
+                *messages,
+                {"role": "assistant", "content": raw or ""},
+                {"role": "user", "content": _correction_request(e)},
+            ]
+    store_cached_extraction(paper_text, _OPENAI_MODEL, _PROMPT_VERSION, result)
+    return result
+
+def _process_paper(paper_id: str, uri: str) -> tuple[str, dict | None]:
+    print(f"[TRACE] Extracting CPAs from {uri} …")
+    return paper_id, _extract(_stream_s3_text(uri))
+
+def _store_results(cur, results: list[tuple[str, dict | None]]) -> int:
+    """Queue every outcome of a batch on *cur*; the caller commits once. Returns the number COMPLETED."""
+    failed = [(paper_id,) for paper_id, parsed in results if not parsed]
+    completed = [(orjson.dumps(parsed).decode(), paper_id) for paper_id, parsed in results if parsed]
+    if failed:
+        cur.executemany("UPDATE papers SET status='FAILED' WHERE id=%s;", failed)
+    if completed:
+        cur.executemany(
+            "UPDATE papers SET cpa_facts_json=%s, status='COMPLETED' WHERE id=%s;",
+            completed,
+        )
+    return len(completed)
+
+def get_cpa_facts_from_fulltext(
+    file_md5_hash: str | None = None, limit: int = 100, max_workers: int = DEFAULT_MAX_WORKERS
+) -> None:
     if file_md5_hash:
         query = """
             SELECT id, fulltext_s3_uri
@@ -127,6 +147,8 @@ def get_cpa_facts_from_fulltext(file_md5_hash: str | None = None, limit: int = 1
         params = (limit,)
         single_paper = False
 
+    # Short connections only: one for the SELECT, one for every UPDATE at the
+    # end; none is held while the LLM calls run.
     with cursor_ctx() as cur:
         cur.execute(query, params)
         rows = cur.fetchall() if not single_paper else [cur.fetchone()] if cur.rowcount else []
@@ -137,24 +159,16 @@ def get_cpa_facts_from_fulltext(file_md5_hash: str | None = None, limit: int = 1
         print(msg)
         return
 
-    done = 0
-    for row in rows:
-        if not row:
-            continue
-        paper_id, uri = row
-        print(f"[TRACE] Extracting CPAs from {uri} …")
-        parsed = _extract(_stream_s3_text(uri))
+    results = run_bounded(
+        _process_paper,
+        ((row["id"], row["fulltext_s3_uri"]) for row in rows if row),
+        max_workers,
+    )
+
+    for paper_id, parsed in results:
         if not parsed:
-            print("[WARN] Extraction failed; marking FAILED")
-            with cursor_ctx(commit=True) as cur:
-                cur.execute("UPDATE papers SET status='FAILED' WHERE id=%s;", (paper_id,))
-            continue
-        with cursor_ctx(commit=True) as cur:
-            cur.execute(
-                "UPDATE papers SET cpa_facts_json=%s, status='COMPLETED' WHERE id=%s;",
-                (json.dumps(parsed), paper_id),
-            )
-        done += 1
-        print("[TRACE] Paper updated and marked COMPLETED.")
+            print(f"[WARN] Extraction failed for {paper_id}; marking FAILED")
+    with cursor_ctx(commit=True) as cur:
+        done = _store_results(cur, results)
 
     print(f"[TRACE] {done}/{len(rows)} papers updated." if not single_paper else "[TRACE] Done.")
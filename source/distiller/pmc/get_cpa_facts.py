@@ -13,19 +13,21 @@ programmatically on rows in the `papers` table:
 """
 from __future__ import annotations
 
-import json
+import orjson
 import os
-import re
 import sys
 from typing import Any, Dict, List
 
-import boto3
 import google.generativeai as genai
 from dotenv import load_dotenv
-from jsonschema import validate, ValidationError
 
 # Local imports
 from ..postgres_connection import cursor_ctx
+from ..utils.concurrency import DEFAULT_MAX_WORKERS, run_bounded
+from ..utils.file_utils import clean_json_response, split_prompt_template
+from ..utils.s3_utils import GLOBAL_S3, read_s3_text
+from ..utils.db_utils import get_cached_extraction, prompt_version, store_cached_extraction
+from ..utils.schema_utils import SchemaValidationError, compile_schema_validator
 
 load_dotenv()
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
@@ -44,19 +46,26 @@ SCHEMA_PATH = os.path.join(os.path.dirname(SCRIPT_DIR), "..", "schema.json")
 PROMPT_PATH = os.path.join(os.path.dirname(SCRIPT_DIR), "..", "gemini_prompt_xml.txt")
 
 with open(SCHEMA_PATH) as fh:
-    SCHEMA_OBJ = json.load(fh)
-    SCHEMA_STR = json.dumps(SCHEMA_OBJ, indent=2)
+    SCHEMA_OBJ = orjson.loads(fh.read())
+    SCHEMA_STR = orjson.dumps(SCHEMA_OBJ, option=orjson.OPT_INDENT_2).decode()
+VALIDATE = compile_schema_validator(SCHEMA_OBJ)
 
 with open(PROMPT_PATH) as fh:
     PROMPT_TEMPLATE = fh.read()
 
-s3 = boto3.client("s3")
+# Static instructions + schema go out as the (cacheable) system instruction.
+PROMPT_PREFIX, PROMPT_SUFFIX = split_prompt_template(PROMPT_TEMPLATE, SCHEMA_STR)
+GEMINI_MODEL = "gemini-2.5-pro"
+PROMPT_VERSION = prompt_version(PROMPT_PREFIX, PROMPT_SUFFIX)
+MODEL = genai.GenerativeModel(
+    GEMINI_MODEL,
+    system_instruction=PROMPT_PREFIX,
+    generation_config={"response_mime_type": "application/json"},
+)
 
-# ---------- helpers ----------
+s3 = GLOBAL_S3
 
-def _strip_code_block(text: str) -> str:
-    """Remove ```json ... ``` wrappers if present."""
-    return re.sub(r"^```(?:json)?\s*|\s*```$", "", text.strip(), flags=re.IGNORECASE)
+# ---------- helpers ----------
 
 
 def stream_s3_text(file_s3_uri: str) -> str:
@@ -66,35 +75,39 @@ def stream_s3_text(file_s3_uri: str) -> str:
             f"Expected URI to start with {prefix!r}, got {file_s3_uri!r}"
         )
     key = file_s3_uri[len(prefix):]
-    obj = s3.get_object(Bucket=S3_TARGET_BUCKET, Key=key)
-    return obj["Body"].read().decode("utf-8", errors="replace")
+    return read_s3_text(s3, S3_TARGET_BUCKET, key, errors="replace")
 
 
 def extract_with_gemini(xml_text: str) -> Dict[str, Any] | None:
-    prompt = (
-        PROMPT_TEMPLATE.replace("{{SCHEMA}}", SCHEMA_STR)
-        .replace("{{PAPER_TEXT}}", xml_text)
-    )
-    model = genai.GenerativeModel("gemini-2.5-pro")
+    cached = get_cached_extraction(xml_text, GEMINI_MODEL, PROMPT_VERSION)
+    if cached is not None:
+        return cached
     try:
-        response = model.generate_content(prompt)
+        response = MODEL.generate_content(xml_text + PROMPT_SUFFIX)
     except Exception as e:
         print("[ERROR] Gemini API call failed:", e)
         return None
 
-    raw = _strip_code_block(response.text)
+    raw = clean_json_response(response.text)
     try:
-        data = json.loads(raw)
-        validate(instance=data, schema=SCHEMA_OBJ)
+        data = orjson.loads(raw)
+        VALIDATE(data)
+        store_cached_extraction(xml_text, GEMINI_MODEL, PROMPT_VERSION, data)
         return data
-    except (json.JSONDecodeError, ValidationError) as e:
+    except (orjson.JSONDecodeError, *SchemaValidationError) as e:
         print("[ERROR] Gemini output invalid:", e)
         return None
 
+def _process_paper(paper_id: str, s3_uri: str) -> tuple[str, str, Dict[str, Any] | None]:
+    print(f"[TRACE] Processing {s3_uri} …")
+    return paper_id, s3_uri, extract_with_gemini(stream_s3_text(s3_uri))
+
 # ---------- main routine ----------
 
-def get_cpa_facts_from_papers(limit: int = 10) -> None:
-    """Process up to *limit* un-extracted PMC papers."""
+def get_cpa_facts_from_papers(limit: int = 10, max_workers: int = DEFAULT_MAX_WORKERS) -> None:
+    """Process up to *limit* un-extracted PMC papers, *max_workers* at a time."""
+    # Short connections only: one for the SELECT, one for every UPDATE at the
+    # end; none is held while Gemini runs.
     with cursor_ctx() as cur:
         cur.execute(
             """
@@ -115,36 +128,39 @@ def get_cpa_facts_from_papers(limit: int = 10) -> None:
         print("[TRACE] No pending papers found.")
         return
 
-    processed = 0
-    for paper_id, s3_uri in rows:
-        print(f"[TRACE] Processing {s3_uri} …")
-        xml_text = stream_s3_text(s3_uri)
-        parsed = extract_with_gemini(xml_text)
+    results = run_bounded(
+        _process_paper,
+        ((row["id"], row["file_s3_uri"]) for row in rows),
+        max_workers,
+    )
 
+    failed = [(paper_id,) for paper_id, _, parsed in results if not parsed]
+    completed = [(orjson.dumps(parsed).decode(), paper_id) for paper_id, _, parsed in results if parsed]
+    for _, s3_uri, parsed in results:
         if not parsed:
             print(f"[WARN] Extraction failed for {s3_uri}; marking as FAILED")
-            with cursor_ctx(commit=True) as cur:
-                cur.execute(
-                    """
-                    UPDATE papers
-                    SET status = 'FAILED'
-                    WHERE id = %s;
-                    """,
-                    (paper_id,),
-                )
-            continue  # skip to next row
-
-        with cursor_ctx(commit=True) as cur:
-            cur.execute(
+
+    # Single transaction for the whole batch
+    with cursor_ctx(commit=True) as cur:
+        if failed:
+            cur.executemany(
+                """
+                UPDATE papers
+                SET status = 'FAILED'
+                WHERE id = %s;
+                """,
+                failed,
+            )
+        if completed:
+            cur.executemany(
                 """
                 UPDATE papers
                 SET cpa_facts_json = %s,
                     status = 'COMPLETED'
                 WHERE id = %s;
                 """,
-                (json.dumps(parsed), paper_id),
+                completed,
             )
-        processed += 1
-        print(f"[TRACE] Stored metadata and marked COMPLETED for {s3_uri}.")
+    processed = len(completed)
 
     print(f"[TRACE] Completed. {processed}/{len(rows)} papers updated.")
@@ -1,29 +1,45 @@
+import logging
+import orjson
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import requests
-import boto3
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
 from dotenv import load_dotenv
 load_dotenv()
-from time import sleep
+from time import monotonic, sleep
 from ..postgres_connection import cursor_ctx   # adjust import if path differs
+from ..utils.concurrency import run_bounded
+from ..utils.s3_utils import GLOBAL_S3
+log = logging.getLogger(__name__)
 
-def insert_paper_to_psql(pmid: str, file_s3_uri: str) -> bool:
+INSERT_BATCH_SIZE = 1000  # rows per INSERT statement
+COPY_WORKERS = 64  # matches GLOBAL_S3's max_pool_connections
+
+def bulk_insert_papers(rows: list[tuple[str, str]]) -> set[str]:
     """
-    Insert a row for this PubMed record, leaving most columns NULL.
+    Insert a row for each (pmid, file_s3_uri) pair, leaving most columns NULL.
     paper_id is stored as 'PMID:{number}', source is fixed to 'PMC'.
-    If the row already exists we do nothing.
+    Rows that already exist are left alone; returns the paper_ids actually inserted.
     """
-    paper_id = f"PMID:{pmid}"
+    inserted: set[str] = set()
     with cursor_ctx(commit=True) as cur:
-        # rowcount will be 1 on insert, 0 if skipped due to ON CONFLICT
-        cur.execute(
-            """
-            INSERT INTO papers (paper_id, source, file_s3_uri, is_free_fulltext)
-            VALUES (%s, %s, %s, TRUE)
-            ON CONFLICT (paper_id) DO NOTHING;
-            """,
-            (paper_id, "PMC", file_s3_uri),
-        )
-        return cur.rowcount == 1
+        for i in range(0, len(rows), INSERT_BATCH_SIZE):
+            batch = rows[i:i+INSERT_BATCH_SIZE]
+            # RETURNING only yields rows not skipped by ON CONFLICT
+            cur.execute(
+                """
+                INSERT INTO papers (paper_id, source, file_s3_uri, is_free_fulltext)
+                SELECT paper_id, 'PMC', file_s3_uri, TRUE
+                FROM unnest(%s::text[], %s::text[]) AS t(paper_id, file_s3_uri)
+                ON CONFLICT (paper_id) DO NOTHING
+                RETURNING paper_id;
+                """,
+                ([f"PMID:{pmid}" for pmid, _ in batch], [uri for _, uri in batch]),
+            )
+            inserted.update(row["paper_id"] for row in cur.fetchall())
+    return inserted
 
 
 # --- Config, default when extracing free full text articles from pubmed central repository ---
@@ -32,61 +48,118 @@ PMC_S3_XML_FOLDERS = [
     "oa_comm/xml/all",
     "oa_noncomm/xml/all"
 ]
-BATCH_SIZE = 50  # How many PMIDs to map at once; respect NCBI's E-utilities limits
+BATCH_SIZE = 200  # How many PMIDs to map at once; ESummary's per-request cap
+
+# Optional: with a key NCBI allows 10 req/sec instead of 3
+NCBI_API_KEY = os.getenv("NCBI_API_KEY")
 
 S3_TARGET_BUCKET = os.getenv("S3_TARGET_BUCKET")
 if not S3_TARGET_BUCKET:
     raise RuntimeError("S3_TARGET_BUCKET must be defined in .env file")
 
-s3 = boto3.client('s3')
+s3 = GLOBAL_S3
+
+# Keep-alive session: E-utilities batches reuse one TLS connection instead of a handshake each.
+_http = requests.Session()
+_http.mount(
+    "https://",
+    HTTPAdapter(
+        pool_connections=32,
+        pool_maxsize=64,
+        max_retries=Retry(
+            total=5,
+            backoff_factor=0.5,
+            status_forcelist=[429, 500, 502, 503, 504],
+            respect_retry_after_header=True,
+        ),
+    ),
+)
+_HTTP_TIMEOUT = 30  # seconds
+
+# NCBI: max 10 req/sec with a key, 3 without. Batches run concurrently, but request
+# starts are spaced by this interval across all worker threads.
+_ESUMMARY_WORKERS = 10 if NCBI_API_KEY else 3
+_ESUMMARY_INTERVAL = 0.1 if NCBI_API_KEY else 0.34
+_MAX_ESUMMARY_INTERVAL = 2.0
+_rate_lock = threading.Lock()
+_next_request_at = 0.0
+_interval = _ESUMMARY_INTERVAL  # widened while NCBI answers 429, eased back afterwards
+
+def _wait_for_rate_slot() -> None:
+    global _next_request_at
+    with _rate_lock:
+        now = monotonic()
+        delay = _next_request_at - now
+        _next_request_at = max(now, _next_request_at) + _interval
+    if delay > 0:
+        sleep(delay)
+
+def _adapt_rate(res: requests.Response) -> None:
+    global _interval
+    retries = getattr(res.raw, "retries", None)
+    throttled = any(h.status == 429 for h in getattr(retries, "history", ()))
+    with _rate_lock:
+        if throttled:
+            _interval = min(_interval * 2, _MAX_ESUMMARY_INTERVAL)
+            print(f"[WARN] NCBI returned 429; spacing requests {_interval:.2f}s apart")
+        else:
+            _interval = max(_interval * 0.9, _ESUMMARY_INTERVAL)
+
+def _get_pmcids_for_batch(batch: list[str]) -> dict[str, str]:
+    pmid_to_pmcid = {}
+    ids = ",".join(batch)
+    url = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esummary.fcgi"
+    params = {
+        "db": "pubmed",
+        "id": ids,
+        "retmode": "json"
+    }
+    if NCBI_API_KEY:
+        params["api_key"] = NCBI_API_KEY
+    _wait_for_rate_slot()
+    try:
+        res = _http.get(url, params=params, timeout=_HTTP_TIMEOUT)
+        _adapt_rate(res)
+        res.raise_for_status()
+        result = orjson.loads(res.content).get("result") or {}
+    except (requests.RequestException, orjson.JSONDecodeError) as e:
+        # retries are exhausted at this point; report the batch rather than abort the run
+        print(f"[ERROR] ESummary failed for {len(batch)} PMIDs ({batch[0]}…): {e}")
+        return pmid_to_pmcid
+    for pmid in batch:
+        summary = result.get(pmid)
+        if not summary:
+            continue
+        # The PMCID is in the articleids list as "pmc"
+        for aid in summary.get("articleids") or ():
+            if aid.get("idtype") == "pmc":
+                pmcid = aid.get("value")
+                if pmcid:
+                    # Guarantee format: should be "PMC######"
+                    pmid_to_pmcid[pmid] = pmcid if pmcid.startswith("PMC") else "PMC" + pmcid
+                    break
+    return pmid_to_pmcid
 
 def get_pmcids_for_pmids(pmids):
-    # Use NCBI E-utilities esummary to map pmid -> pmcid (works in batches)
+    # Use NCBI E-utilities esummary to map pmid -> pmcid (batches fetched concurrently)
+    batches = ((pmids[i:i+BATCH_SIZE],) for i in range(0, len(pmids), BATCH_SIZE))
     pmid_to_pmcid = {}
-    for i in range(0, len(pmids), BATCH_SIZE):
-        batch = pmids[i:i+BATCH_SIZE]
-        ids = ",".join(batch)
-        url = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esummary.fcgi"
-        params = {
-            "db": "pubmed",
-            "id": ids,
-            "retmode": "json"
-        }
-        res = requests.get(url, params=params)
-        data = res.json()
-        for pmid in batch:
-            summary = data['result'].get(pmid)
-            if summary:
-                # The PMCID is in the articleids list as "pmc"
-                pdf_id = None
-                for aid in summary.get("articleids", []):
-                    if aid.get("idtype") == "pmc" and aid.get("value"):
-                        pmcid = aid["value"]
-                        # Guarantee format: should be "PMC######"
-                        if not pmcid.startswith("PMC"):
-                            pmcid = "PMC" + pmcid
-                        pmid_to_pmcid[pmid] = pmcid
-                        break
-        sleep(0.34)  # NCBI recommends max 3 req/sec
+    for partial in run_bounded(_get_pmcids_for_batch, batches, _ESUMMARY_WORKERS):
+        pmid_to_pmcid.update(partial)
     return pmid_to_pmcid
 
 def copy_xml_to_target_bucket(pmcid: str, dest_key: str) -> bool:
     filename = f"{pmcid}.xml"  # dest_key already built by caller
     for folder in PMC_S3_XML_FOLDERS:
         source_key = f"{folder}/{filename}"
+        copy_source = {'Bucket': PMC_S3_SOURCE_BUCKET, 'Key': source_key}
         try:
-            # Check if file exists
-            s3.head_object(Bucket=PMC_S3_SOURCE_BUCKET, Key=source_key)
-            # If found, copy to target
-            s3.copy(
-                {'Bucket': PMC_S3_SOURCE_BUCKET, 'Key': source_key},
-                S3_TARGET_BUCKET,
-                dest_key
-            )
-            print(f"Copied PMC XML {pmcid}: {PMC_S3_SOURCE_BUCKET}/{source_key} -> {S3_TARGET_BUCKET}/{dest_key}")
+            # Copy straight away; a missing source comes back as NoSuchKey
+            s3.copy_object(Bucket=S3_TARGET_BUCKET, Key=dest_key, CopySource=copy_source)
+            log.debug("Copied PMC XML %s: %s/%s -> %s/%s", pmcid, PMC_S3_SOURCE_BUCKET, source_key, S3_TARGET_BUCKET, dest_key)
             return True
         except s3.exceptions.ClientError as e:
-            if e.response['Error']['Code'] == "404":
+            if e.response['Error']['Code'] in ("404", "NoSuchKey"):
                 continue
             else:
                 print(f"Error for {pmcid}: {e}")
@@ -94,10 +167,22 @@ def copy_xml_to_target_bucket(pmcid: str, dest_key: str) -> bool:
     print(f"PMC XML for {pmcid} NOT FOUND in PMC Open Access folders.")
     return False
 
+def _existing_paper_ids(paper_ids: list[str]) -> set[str]:
+    """One round trip to find which ids are already in papers, before any NCBI/S3 work."""
+    if not paper_ids:
+        return set()
+    with cursor_ctx() as cur:
+        cur.execute("SELECT paper_id FROM papers WHERE paper_id = ANY(%s);", (paper_ids,))
+        return {row["paper_id"] for row in cur.fetchall()}
+
 def get_papers_from_pmc(PMIDS_FILE):
-    # Read PMIDs as strings (strip any whitespace)
+    # Read PMIDs as strings (strip any whitespace), one line at a time
     with open(PMIDS_FILE) as f:
-        pmids = [line.strip() for line in f if line.strip().isdigit()]
+        pmids = list(dict.fromkeys(pmid for pmid in map(str.strip, f) if pmid.isdigit()))
+    known = _existing_paper_ids([f"PMID:{pmid}" for pmid in pmids])
+    if known:
+        print(f"Skipping {len(known)} PMIDs already present in papers.")
+        pmids = [pmid for pmid in pmids if f"PMID:{pmid}" not in known]
     print(f"Looking up {len(pmids)} PMIDs...")
     pmid_to_pmcid = get_pmcids_for_pmids(pmids)
     print(f"Found PMCIDs for {len(pmid_to_pmcid)} PMIDs.")
@@ -105,15 +190,21 @@ def get_papers_from_pmc(PMIDS_FILE):
     print(f"Processing {len(valid_pairs)} PMIDs that have a PMC entry...")
 
     inserted = skipped = 0
+    fresh = bulk_insert_papers(
+        [(pmid, f"s3://{S3_TARGET_BUCKET}/raw/{pmcid}.xml") for pmid, pmcid in valid_pairs]
+    )
+    to_copy = []
     for pmid, pmcid in valid_pairs:
-        dest_key = f"raw/{pmcid}.xml"
-        file_s3_uri = f"s3://{S3_TARGET_BUCKET}/{dest_key}"
-        if insert_paper_to_psql(pmid, file_s3_uri):
-            copy_xml_to_target_bucket(pmcid, dest_key)  # copy only on fresh insert
+        if f"PMID:{pmid}" in fresh:
+            to_copy.append((pmcid, f"raw/{pmcid}.xml"))  # copy only on fresh insert
             inserted += 1
         else:
-            print(f"Skipped PMDID:{pmid},already present in papers.") 
+            log.debug("Skipped PMID:%s, already present in papers.", pmid)
             skipped += 1
+    with ThreadPoolExecutor(max_workers=COPY_WORKERS) as pool:
+        # list() drains the iterator so worker exceptions are not silently dropped
+        # several PMIDs can resolve to one PMCID; copy each object once
+        list(pool.map(lambda pair: copy_xml_to_target_bucket(*pair), dict.fromkeys(to_copy)))
     print(f"Inserted {inserted} new rows into papers.")
     print(f"Skipped {skipped} rows already present in papers.") 
 
@@ -1,12 +1,16 @@
 from __future__ import annotations
+import atexit
 import os
+import threading
 from contextlib import contextmanager
 from typing import Iterator, Generator, Optional, Any
 import psycopg
 from psycopg import Connection as _PGConnection
 from psycopg import Cursor as _PGCursor
 from pgvector.psycopg import register_vector
+from psycopg.conninfo import make_conninfo
 from psycopg.rows import dict_row
+from psycopg_pool import ConnectionPool
 
 
 _DB_NAME: str = os.getenv("PGDATABASE", "postgres")
@@ -14,6 +18,13 @@ _DB_USER: str = os.getenv("PGUSER", "postgres")
 _DB_PASSWORD: str = os.getenv("PGPASSWORD", "postgres")
 _DB_HOST: str = os.getenv("PGHOST", "localhost")
 _DB_PORT: str | int = os.getenv("PGPORT", "5432")  # int or str OK for psycopg
+# Sized for the widest worker pool: 16 OCR threads in mistral_ocr.extractor,
+# each holding its own connection plus one nested LLM-cache lookup
+# (get_cached_extraction / store_cached_extraction take a cursor_ctx).
+_POOL_MAX_SIZE = int(os.getenv("PGPOOL_MAX_SIZE", "32"))
+
+_pool: ConnectionPool | None = None
+_pool_lock = threading.Lock()
 
 
 def get_connection(
@@ -32,14 +43,50 @@ def get_connection(
     )
 
 
+def _configure(conn: _PGConnection) -> None:
+    register_vector(conn)
+    conn.commit()  # the type lookup opened a transaction; pool connections must be idle
+
+
+def _get_pool() -> ConnectionPool:
+    """Default-database pool, opened on first use and shared by every thread."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool(
+                conninfo=make_conninfo(
+                    dbname=_DB_NAME, user=_DB_USER, password=_DB_PASSWORD, host=_DB_HOST, port=_DB_PORT
+                ),
+                min_size=1,
+                max_size=_POOL_MAX_SIZE,
+                configure=_configure,
+                open=True,
+            )
+            atexit.register(_pool.close)
+        return _pool
+
+
 @contextmanager
 def connection_ctx(**kwargs: Any) -> Generator[_PGConnection, None, None]:
-    conn = get_connection(**kwargs)
-    register_vector(conn)
+    if kwargs:
+        # explicit connection parameters: one-off connection outside the pool
+        conn = get_connection(**kwargs)
+        register_vector(conn)
+        try:
+            yield conn
+        finally:
+            conn.close()
+        return
+
+    pool = _get_pool()
+    conn = pool.getconn()
     try:
         yield conn
     finally:
-        conn.close()
+        # same contract as a closed connection: anything not committed is discarded
+        if not conn.closed:
+            conn.rollback()
+        pool.putconn(conn)
 
 
 @contextmanager
@@ -57,8 +104,19 @@ def cursor_ctx(commit: bool = False, **kwargs: Any) -> Generator[_PGCursor, None
             cur.close()
 
 
+@contextmanager
+def shared_cursor_ctx(cur: _PGCursor | None = None) -> Generator[_PGCursor, None, None]:
+    """Yield *cur* untouched (its owner commits), or a fresh committing cursor_ctx when None."""
+    if cur is not None:
+        yield cur
+        return
+    with cursor_ctx(commit=True) as own:
+        yield own
+
+
 __all__ = [
     "get_connection",
     "connection_ctx",
     "cursor_ctx",
+    "shared_cursor_ctx",
 ]
\ No newline at end of file
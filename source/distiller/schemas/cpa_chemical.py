@@ -5,18 +5,20 @@ or just keep them around for type safety.
 """
 from __future__ import annotations
 
-import json, hashlib
+import logging
 from enum import Enum
-from typing import List, Optional, Dict, Any
-from uuid import UUID
+from typing import List, Optional, Dict, Any, Tuple
+from uuid import UUID, uuid4
 from datetime import datetime
 
+import orjson
 from pydantic import BaseModel, Field, ConfigDict
-from psycopg.errors import UniqueViolation
 # ---------------------------------------------------------------
 # Re‑use definitions that already live in cryo_schema.py
 from distiller.schemas.structured_output import PropertyType, FactValue
 
+log = logging.getLogger(__name__)
+
 
 # ---------------------------------------------------------------
 # Re‑encode the SQL ENUM so that the app can reason about it
@@ -29,21 +31,33 @@ class FactValueKind(str, Enum):
 
 
 
+# Exact-type lookup covers the plain JSON values; Point/Range go by value_type.
+_KIND_BY_TYPE: Dict[type, FactValueKind] = {
+    float: FactValueKind.RAW,
+    int: FactValueKind.RAW,
+    bool: FactValueKind.RAW,
+    str: FactValueKind.RAW,
+    dict: FactValueKind.STRUCT,
+}
+_KIND_BY_VALUE_TYPE = {"point": FactValueKind.POINT, "range": FactValueKind.RANGE}
+
+
 def _detect_value_kind(value: FactValue) -> FactValueKind:
     # Only support allowed types in your schema.
-    if hasattr(value, "value_type"):  # Pydantic model (Point/Range)
-        if value.value_type == "point":
-            return FactValueKind.POINT
-        elif value.value_type == "range":
-            return FactValueKind.RANGE
-    elif isinstance(value, (float, int, str)):
+    kind = _KIND_BY_TYPE.get(type(value))
+    if kind is not None:
+        return kind
+    value_type = getattr(value, "value_type", None)  # Pydantic model (Point/Range)
+    if value_type is not None:
+        return _KIND_BY_VALUE_TYPE.get(value_type)
+    # subclasses (str enums, dict subclasses) fall through to the slow path
+    if isinstance(value, (float, int, str)):
         return FactValueKind.RAW
-    elif isinstance(value, dict):
+    if isinstance(value, dict):
         return FactValueKind.STRUCT
-    else:
-        raise TypeError(
-            f"Unsupported FactValue type: {type(value)} ({value!r})"
-        )
+    raise TypeError(
+        f"Unsupported FactValue type: {type(value)} ({value!r})"
+    )
 
 
 # ---------------------------------------------------------------
@@ -68,6 +82,13 @@ class ChemicalProperty(BaseModel):
     model_config = ConfigDict(extra="forbid")
 
 
+# Column order of the tuples produced by ChemicalPropertyValue.to_row_tuples
+PROPERTY_VALUE_COLUMNS = (
+    "id", "property_id", "value_kind", "numeric_value", "range_min",
+    "range_max", "raw_value", "extra", "unit",
+)
+
+
 class ChemicalPropertyValue(BaseModel):
     """Row in table `chemical_property_values`."""
     id            : UUID | None = None
@@ -94,7 +115,8 @@ class ChemicalPropertyValue(BaseModel):
         created_at: datetime | None = None
     ) -> "ChemicalPropertyValue":
         kind = _detect_value_kind(value)
-        print(f'[TRACE] from_fact_value: {kind}, {value}')
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("from_fact_value: %s %r", kind, value)
         kw: Dict[str, Any] = dict(
             property_id=property_id,
             value_kind=kind,
@@ -115,6 +137,35 @@ class ChemicalPropertyValue(BaseModel):
             raise TypeError(f"Unknown FactValueKind: {kind}")
         return cls(**kw)
 
+    # Bulk path: plain tuples for COPY, no model instance per value
+    @classmethod
+    def to_row_tuples(
+        cls, items: List[Tuple[UUID, FactValue, Optional[str]]]
+    ) -> List[tuple]:
+        """
+        One tuple per (property_id, value, unit) in PROPERTY_VALUE_COLUMNS order.
+        The row id is generated here so callers can reference it without RETURNING.
+        """
+        rows = []
+        for property_id, value, unit in items:
+            kind = _detect_value_kind(value)
+            numeric_value = range_min = range_max = raw_value = extra = None
+            if kind == FactValueKind.POINT:
+                numeric_value = float(value.value)
+            elif kind == FactValueKind.RANGE:
+                range_min, range_max = float(value.min), float(value.max)
+            elif kind == FactValueKind.RAW:
+                raw_value = value
+            elif kind == FactValueKind.STRUCT:
+                extra = orjson.dumps(value).decode()
+            else:
+                raise TypeError(f"Unknown FactValueKind: {kind}")
+            rows.append((
+                uuid4(), property_id, kind.value, numeric_value, range_min,
+                range_max, raw_value, extra, unit,
+            ))
+        return rows
+
 
 class CPAReference(BaseModel):
     """Row in table `cpa_references`."""
@@ -33,7 +33,7 @@ from distiller.schemas.structured_output import (
 # ────────────────────────────────────────────────────────────────
 # 0.  Shared helpers / vocab
 # ────────────────────────────────────────────────────────────────
-_INCHIKEY_RE = re.compile(r"^[A-Z0-9]{14}-[A-Z0-9]{10}-[A-Z]$")
+_INCHIKEY_RE = re.compile(r"[A-Z0-9]{14}-[A-Z0-9]{10}-[A-Z]")  # used with fullmatch
 
 class ChemicalRole(str, Enum):
     CPA      = "CPA"
@@ -78,7 +78,10 @@ class MoleculeCoreData(BaseModel):
     @field_validator("inchikey")
     @classmethod
     def _validate_inchikey(cls, v: Optional[str]) -> Optional[str]:
-        if v is not None and not _INCHIKEY_RE.match(v):
+        if v is None:
+            return v
+        # cheap 14-10-1 shape check first; most malformed ids never reach the regex
+        if len(v) != 27 or v[14] != "-" or v[25] != "-" or not _INCHIKEY_RE.fullmatch(v):
             raise ValueError("Invalid InChIKey format.")
         return v
 
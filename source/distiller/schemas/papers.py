@@ -3,7 +3,7 @@ from enum import Enum
 from typing import Any, Dict, Optional
 from uuid import UUID
 from datetime import datetime
-from pydantic import BaseModel, Field, field_validator
+from pydantic import BaseModel, ConfigDict, Field, field_validator
 
 
 class PaperStatus(str, Enum):
@@ -45,6 +45,9 @@ class Paper(BaseModel):
     md5_hash: Optional[str] = Field(
         None, min_length=32, max_length=32, description="MD5 hash of the PDF/XML file"
     )
+    content_hash: Optional[str] = Field(
+        None, min_length=32, max_length=32, description="BLAKE3 dedup hash of the PDF/XML file"
+    )
     file_size_bytes: Optional[int] = None
     file_s3_uri: Optional[str] = None
     fulltext_s3_uri: Optional[str] = None
@@ -56,9 +59,7 @@ class Paper(BaseModel):
     status: PaperStatus = Field(PaperStatus.PENDING, description="Processing status")
     created_at: Optional[datetime] = None
 
-    class Config:  # type: ignore[override]
-        orm_mode = True  # Pydantic v1; accepted by v2 as well
-        from_attributes = True  # Pydantic v2 equivalent
+    model_config = ConfigDict(from_attributes=True)
 
     # ───────────────────────── validators ────────────────────────
     @field_validator("md5_hash", mode="before")
@@ -1,6 +1,24 @@
 
-from pydantic import BaseModel
+from pydantic import BaseModel, field_validator
+
+# Combinations run_pipeline knows how to execute; anything else is rejected at parse time.
+ALLOWED_DISTILLERS = frozenset({"llama_parse"})
+ALLOWED_MODELS = frozenset({"gpt-4.1-mini", "claude-sonnet-4-20250514"})
 
 class PipelineConfig(BaseModel):
     distiller: str
-    llm_model_parser: str
\ No newline at end of file
+    llm_model_parser: str
+
+    @field_validator("distiller")
+    @classmethod
+    def _check_distiller(cls, v: str) -> str:
+        if v not in ALLOWED_DISTILLERS:
+            raise ValueError(f"Invalid distiller: {v!r}")
+        return v
+
+    @field_validator("llm_model_parser")
+    @classmethod
+    def _check_model(cls, v: str) -> str:
+        if v not in ALLOWED_MODELS:
+            raise ValueError(f"Invalid llm_model_parser: {v!r}")
+        return v
@@ -15,13 +15,13 @@ from pydantic import (
 # Regex patterns for external IDs
 _DOI_PAT   = re.compile(r"^10\.\d{4,9}/[-._;()/:A-Z0-9]+$", re.I)
 _ARXIV_PAT = re.compile(r"^(arXiv:)?\d{4}\.\d{4,5}(v\d+)?$", re.I)
-_INCHI_PAT = re.compile(r"^[A-Z]{14}-[A-Z]{10}-[A-Z]$", re.I)  # 14‑10‑1 blocks
+_INCHI_PAT = re.compile(r"[A-Z]{14}-[A-Z]{10}-[A-Z]", re.I)  # 14‑10‑1 blocks, used with fullmatch
 
 def _validate_inchikey(v: Optional[str]) -> Optional[str]:
     """Return None or a normalised (upper‑case) InChIKey."""
     if v is None:
         return v
-    if not _INCHI_PAT.match(v):
+    if len(v) != 27 or v[14] != "-" or v[25] != "-" or not _INCHI_PAT.fullmatch(v):
         raise ValueError(
             "agent_id must be a valid InChIKey "
             "(e.g. 'BSYNRYMUTXBXSQ-UHFFFAOYSA-N') or null"
@@ -78,55 +78,37 @@ class UnitSpec(BaseModel):
     units       : List[str]
     model_config = ConfigDict(extra="forbid")
 
-class FactUnitDefaults(BaseModel):
-    MOLECULAR_MASS                : UnitSpec
-    SOLUBILITY                    : UnitSpec
-    VISCOSITY                     : UnitSpec
-    TG_PRIME                      : UnitSpec
-    PARTITION_COEFFICIENT         : UnitSpec
-    DIELECTRIC_CONSTANT           : Optional[UnitSpec]
-    THERMAL_CONDUCTIVITY          : UnitSpec
-    HEAT_CAPACITY                 : UnitSpec
-    THERMAL_EXPANSION_COEFFICIENT : UnitSpec
-    CRYSTALLIZATION_TEMPERATURE   : UnitSpec
-    DIFFUSION_COEFFICIENT         : UnitSpec
-    HYDROGEN_BOND_DONORS_ACCEPTORS: UnitSpec
-    SOURCE_OF_COMPOUND            : UnitSpec
-    GRAS_CERTIFICATION            : UnitSpec
-    MELTING_POINT                 : UnitSpec
-    HYDROPHOBICITY                : UnitSpec
-    DENSITY                       : UnitSpec
-    REFRACTIVE_INDEX              : Optional[UnitSpec]
-    SURFACE_TENSION               : UnitSpec
-    PH                            : Optional[UnitSpec]
-    OSMOLALITY_OSMOLARITY         : UnitSpec
-    POLAR_SURFACE_AREA            : UnitSpec
-    model_config = ConfigDict(extra="forbid")
-
-FACT_UNIT_DEFAULTS = FactUnitDefaults(
-    MOLECULAR_MASS                = UnitSpec(defaultUnit="g/mol",       units=["g/mol", "Da", "kDa"]),
-    SOLUBILITY                    = UnitSpec(defaultUnit="mg/mL",       units=["mg/mL", "g/100 mL", "% w/v"]),
-    VISCOSITY                     = UnitSpec(defaultUnit="mPa.s",       units=["mPa.s", "cP"]),
-    TG_PRIME                      = UnitSpec(defaultUnit="degC",        units=["degC", "degK"]),
-    PARTITION_COEFFICIENT         = UnitSpec(defaultUnit="logP",        units=["logP"]),
-    DIELECTRIC_CONSTANT           = None,
-    THERMAL_CONDUCTIVITY          = UnitSpec(defaultUnit="W/(m.K)",     units=["W/(m.K)"]),
-    HEAT_CAPACITY                 = UnitSpec(defaultUnit="J/(g.K)",     units=["J/(g.K)", "J/(mol.K)"]),
-    THERMAL_EXPANSION_COEFFICIENT = UnitSpec(defaultUnit="1/K",         units=["1/K"]),
-    CRYSTALLIZATION_TEMPERATURE   = UnitSpec(defaultUnit="degC",        units=["degC", "degK"]),
-    DIFFUSION_COEFFICIENT         = UnitSpec(defaultUnit="m2/s",        units=["m2/s", "cm2/s"]),
-    HYDROGEN_BOND_DONORS_ACCEPTORS= UnitSpec(defaultUnit="count",       units=["count"]),
-    SOURCE_OF_COMPOUND            = UnitSpec(defaultUnit="text",        units=["text"]),
-    GRAS_CERTIFICATION            = UnitSpec(defaultUnit="boolean",     units=["boolean"]),
-    MELTING_POINT                 = UnitSpec(defaultUnit="degC",        units=["degC", "degK"]),
-    HYDROPHOBICITY                = UnitSpec(defaultUnit="qualitative", units=["qualitative"]),
-    DENSITY                       = UnitSpec(defaultUnit="g/cm3",       units=["g/cm3", "kg/m3"]),
-    REFRACTIVE_INDEX              = None,
-    SURFACE_TENSION               = UnitSpec(defaultUnit="mN/m",        units=["mN/m", "dyn/cm"]),
-    PH                            = None,
-    OSMOLALITY_OSMOLARITY         = UnitSpec(defaultUnit="Osmol/kg",    units=["Osmol/kg", "Osmol/L"]),
-    POLAR_SURFACE_AREA            = UnitSpec(defaultUnit="A2",          units=["A2"]),
-)
+# Static unit table per PropertyType name (None: no fixed unit); every PropertyType must appear.
+FACT_UNIT_DEFAULTS: Dict[str, Optional[UnitSpec]] = {
+    "MOLECULAR_MASS"                : UnitSpec(defaultUnit="g/mol",       units=["g/mol", "Da", "kDa"]),
+    "SOLUBILITY"                    : UnitSpec(defaultUnit="mg/mL",       units=["mg/mL", "g/100 mL", "% w/v"]),
+    "VISCOSITY"                     : UnitSpec(defaultUnit="mPa.s",       units=["mPa.s", "cP"]),
+    "TG_PRIME"                      : UnitSpec(defaultUnit="degC",        units=["degC", "degK"]),
+    "PARTITION_COEFFICIENT"         : UnitSpec(defaultUnit="logP",        units=["logP"]),
+    "DIELECTRIC_CONSTANT"           : None,
+    "THERMAL_CONDUCTIVITY"          : UnitSpec(defaultUnit="W/(m.K)",     units=["W/(m.K)"]),
+    "HEAT_CAPACITY"                 : UnitSpec(defaultUnit="J/(g.K)",     units=["J/(g.K)", "J/(mol.K)"]),
+    "THERMAL_EXPANSION_COEFFICIENT" : UnitSpec(defaultUnit="1/K",         units=["1/K"]),
+    "CRYSTALLIZATION_TEMPERATURE"   : UnitSpec(defaultUnit="degC",        units=["degC", "degK"]),
+    "DIFFUSION_COEFFICIENT"         : UnitSpec(defaultUnit="m2/s",        units=["m2/s", "cm2/s"]),
+    "HYDROGEN_BOND_DONORS_ACCEPTORS": UnitSpec(defaultUnit="count",       units=["count"]),
+    "SOURCE_OF_COMPOUND"            : UnitSpec(defaultUnit="text",        units=["text"]),
+    "GRAS_CERTIFICATION"            : UnitSpec(defaultUnit="boolean",     units=["boolean"]),
+    "MELTING_POINT"                 : UnitSpec(defaultUnit="degC",        units=["degC", "degK"]),
+    "HYDROPHOBICITY"                : UnitSpec(defaultUnit="qualitative", units=["qualitative"]),
+    "DENSITY"                       : UnitSpec(defaultUnit="g/cm3",       units=["g/cm3", "kg/m3"]),
+    "REFRACTIVE_INDEX"              : None,
+    "SURFACE_TENSION"               : UnitSpec(defaultUnit="mN/m",        units=["mN/m", "dyn/cm"]),
+    "PH"                            : None,
+    "OSMOLALITY_OSMOLARITY"         : UnitSpec(defaultUnit="Osmol/kg",    units=["Osmol/kg", "Osmol/L"]),
+    "POLAR_SURFACE_AREA"            : UnitSpec(defaultUnit="A2",          units=["A2"]),
+}
+
+# Allowed units per property type (None: free unit, non-numeric); built once for the validators.
+_UNIT_SETS: Dict[PropertyType, Optional[frozenset[str]]] = {
+    pt: frozenset(spec.units) if (spec := FACT_UNIT_DEFAULTS[pt.name]) is not None else None
+    for pt in PropertyType
+}
 
 class DependentPropertyType(str, Enum):
     MEMBRANE_PERMEABILITY   = "MEMBRANE_PERMEABILITY"
@@ -276,8 +258,7 @@ class AgentProperty(BaseModel):  # renamed from CPAProperty
             return v                      # nothing to compare against
 
         # UnitSpec present  → this is a numeric property
-        unit_spec = getattr(FACT_UNIT_DEFAULTS, ptype.name, None)
-        if isinstance(unit_spec, UnitSpec):
+        if _UNIT_SETS.get(ptype) is not None:
             ok_types = (int, float, PointValue, RangeValue)
             if isinstance(v, ok_types):
                 return v
@@ -295,14 +276,14 @@ class AgentProperty(BaseModel):  # renamed from CPAProperty
         ptype = info.data.get("prop_type")
         if ptype is None:
             return v
-        unit_spec = getattr(FACT_UNIT_DEFAULTS, ptype.name)
+        allowed = _UNIT_SETS.get(ptype)
         # If no UnitSpec defined, skip validation
-        if unit_spec is None:
+        if allowed is None:
             return v
-        if v not in unit_spec.units:
+        if v not in allowed:
             raise ValueError(
                 f"Unit '{v}' invalid for prop_type '{ptype}'. "
-                f"Allowed: {unit_spec.units}"
+                f"Allowed: {FACT_UNIT_DEFAULTS[ptype.name].units}"
             )
         return v
 
@@ -335,31 +316,68 @@ class CPAPaperData(BaseModel):
             return v
         raise ValueError("paper_id must be a DOI, arXiv ID, or UUID")
 
+    @classmethod
+    def assemble_trusted(
+        cls,
+        *,
+        paper_id: str,
+        title: str,
+        chemical_agents: List[ChemicalAgent],
+        experiments: List[Experiment],
+        formulations: List[Formulation],
+        agent_properties: List[AgentProperty],
+        link: Optional[HttpUrl] = None,
+    ) -> "CPAPaperData":
+        """
+        Build the aggregate from sub-models that were already validated
+        (e.g. the per-pass extraction outputs) without re-validating every
+        nested field. Only the paper_id shape and the cross-reference checks
+        are run. Use `model_validate` for anything coming straight from LLM JSON.
+        """
+        paper = cls.model_construct(
+            paper_id=cls._valid_paper_id(paper_id),
+            title=title,
+            link=link,
+            chemical_agents=list(chemical_agents),
+            experiments=list(experiments),
+            formulations=list(formulations),
+            agent_properties=list(agent_properties),
+        )
+        return paper._check_refs()
+
     # Cross‑reference checks
     @model_validator(mode="after")
     def _check_refs(self):
         exp_ids   = {e.experiment_id for e in self.experiments}
         agent_ids = {a.agent_id for a in self.chemical_agents if a.agent_id}
 
+        # Set differences first; walk the items again only to name the offender.
         # Every formulation must reference an existing experiment
-        for f in self.formulations:
-            if f.experiment_id not in exp_ids:
-                raise ValueError(
-                    f"Formulation {f.formulation_id} "
-                    f"references missing experiment_id {f.experiment_id}"
-                )
-            # Each component's agent_id (if any) must exist in registry
-            for c in f.components:
-                if c.agent_id and c.agent_id not in agent_ids:
-                    raise ValueError(
-                        f"Component {c.component_id} uses unknown agent_id '{c.agent_id}'"
-                    )
+        missing_exps = {f.experiment_id for f in self.formulations} - exp_ids
+        if missing_exps:
+            f = next(f for f in self.formulations if f.experiment_id in missing_exps)
+            raise ValueError(
+                f"Formulation {f.formulation_id} "
+                f"references missing experiment_id {f.experiment_id}"
+            )
+
+        # Each component's agent_id (if any) must exist in registry
+        comp_agent_ids = {c.agent_id for f in self.formulations for c in f.components if c.agent_id}
+        if not comp_agent_ids <= agent_ids:
+            c = next(
+                c for f in self.formulations for c in f.components
+                if c.agent_id and c.agent_id not in agent_ids
+            )
+            raise ValueError(
+                f"Component {c.component_id} uses unknown agent_id '{c.agent_id}'"
+            )
 
         # Each agent_property must refer to a registered agent (if specified)
-        for ap in self.agent_properties:
-            if ap.agent_id and ap.agent_id not in agent_ids:
-                raise ValueError(
-                    f"AgentProperty {ap.property_id} refers to unknown agent_id "
-                    f"'{ap.agent_id}'"
-                )
+        prop_agent_ids = {ap.agent_id for ap in self.agent_properties if ap.agent_id}
+        if not prop_agent_ids <= agent_ids:
+            ap = next(ap for ap in self.agent_properties if ap.agent_id and ap.agent_id not in agent_ids)
+            raise ValueError(
+                f"AgentProperty {ap.agent_label!r} refers to unknown agent_id "
+                f"'{ap.agent_id}'"
+            )
         return self
\ No newline at end of file
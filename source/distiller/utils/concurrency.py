@@ -0,0 +1,27 @@
+from __future__ import annotations
+import asyncio
+from typing import Callable, Iterable, TypeVar
+
+T = TypeVar("T")
+
+DEFAULT_MAX_WORKERS = 5  # keep well under the LLM providers' rate limits
+
+
+async def gather_bounded(
+    fn: Callable[..., T], items: Iterable[tuple], max_workers: int = DEFAULT_MAX_WORKERS
+) -> list[T]:
+    """Await ``fn(*item)`` for every item in a worker thread, at most *max_workers* at a time."""
+    sem = asyncio.Semaphore(max_workers)
+
+    async def _run(args: tuple) -> T:
+        async with sem:
+            return await asyncio.to_thread(fn, *args)
+
+    return await asyncio.gather(*(_run(args) for args in items))
+
+
+def run_bounded(
+    fn: Callable[..., T], items: Iterable[tuple], max_workers: int = DEFAULT_MAX_WORKERS
+) -> list[T]:
+    """Blocking wrapper around `gather_bounded`; results keep the order of *items*."""
+    return asyncio.run(gather_bounded(fn, items, max_workers))
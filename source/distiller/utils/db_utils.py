@@ -1,5 +1,68 @@
+import hashlib
+from collections.abc import Iterable
+import psycopg
+from psycopg import sql
+from psycopg.types.json import Json
+from distiller.postgres_connection import cursor_ctx
+
 def hash_in_psql(file_md5_hash: str, cur) -> bool:
 
     print(f"[TRACE] Checking if MD5 hash {file_md5_hash} is in psql")
     cur.execute("SELECT 1 FROM papers WHERE md5_hash = %s LIMIT 1;", (file_md5_hash,))
     return cur.fetchone() is not None
+
+
+def existing_hashes(hashes: Iterable[str], cur, column: str = "md5_hash") -> set[str]:
+    """Return the subset of *hashes* already in papers.<column>, in one round-trip (tuple-row cursor)."""
+    if column not in ("md5_hash", "content_hash"):
+        raise ValueError(f"Unsupported hash column: {column!r}")
+    hashes = list(hashes)
+    if not hashes:
+        return set()
+
+    print(f"[TRACE] Checking {len(hashes)} {column} values against psql")
+    cur.execute(
+        sql.SQL("SELECT {col} FROM papers WHERE {col} = ANY(%s);").format(col=sql.Identifier(column)),
+        (hashes,),
+    )
+    return {row[0] for row in cur.fetchall()}
+
+
+def prompt_version(*parts: str) -> str:
+    """Short fingerprint of the rendered prompt/schema; edits invalidate the LLM cache."""
+    return hashlib.sha256("\x00".join(parts).encode()).hexdigest()[:16]
+
+
+def get_cached_extraction(text: str, model: str, schema_version: str) -> dict | None:
+    """Return a previously validated LLM result for exactly this text, or None."""
+    try:
+        with cursor_ctx() as cur:
+            cur.execute(
+                "SELECT result FROM llm_extraction_cache "
+                "WHERE content_sha256 = %s AND model = %s AND schema_version = %s;",
+                (_sha256(text), model, schema_version),
+            )
+            row = cur.fetchone()
+    except psycopg.Error as e:
+        print(f"[WARN] LLM cache lookup failed: {e}")
+        return None
+    if row:
+        print("[TRACE] LLM cache hit")
+        return row["result"]
+    return None
+
+
+def store_cached_extraction(text: str, model: str, schema_version: str, result: dict) -> None:
+    try:
+        with cursor_ctx(commit=True) as cur:
+            cur.execute(
+                "INSERT INTO llm_extraction_cache (content_sha256, model, schema_version, result) "
+                "VALUES (%s, %s, %s, %s) ON CONFLICT DO NOTHING;",
+                (_sha256(text), model, schema_version, Json(result)),
+            )
+    except psycopg.Error as e:
+        print(f"[WARN] LLM cache write failed: {e}")
+
+
+def _sha256(text: str) -> str:
+    return hashlib.sha256(text.encode()).hexdigest()
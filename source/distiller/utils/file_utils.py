@@ -1,17 +1,68 @@
 import hashlib
+import mmap
+import os
 import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+import blake3
+
+_CODE_BLOCK_RE = re.compile(r'^```(?:json)?\s*|\s*```$', re.IGNORECASE)
+
+_MMAP_THRESHOLD = 8 << 20  # 8 MiB
+_MMAP_MAX = 2 << 30  # 2 GiB; bigger files keep the chunked path
 
 def generate_md5(file_path):
     """Generate MD5 hash of the file's contents."""
 
     print(f"[TRACE] Generating MD5 hash for file: {file_path}")
-    hash_md5 = hashlib.md5()
-    with open(file_path, "rb") as f:
-        for chunk in iter(lambda: f.read(4096), b""):   
+    with open(file_path, "rb", buffering=0) as f:
+        if _MMAP_THRESHOLD < os.fstat(f.fileno()).st_size <= _MMAP_MAX:
+            # hash the mapped pages in place, no copies into Python buffers
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as view:
+                return hashlib.md5(view).hexdigest()
+        if hasattr(hashlib, "file_digest"):  # Python 3.11+: read/update loop runs in C
+            return hashlib.file_digest(f, "md5").hexdigest()
+        hash_md5 = hashlib.md5()
+        for chunk in iter(lambda: f.read(1 << 20), b""):
             hash_md5.update(chunk)
     return hash_md5.hexdigest()
 
+def generate_content_hash(file_path):
+    """BLAKE3 fingerprint (32 hex chars) of the file's contents, used for dedup only."""
+
+    print(f"[TRACE] Generating content hash for file: {file_path}")
+    with open(file_path, "rb", buffering=0) as f:
+        if os.fstat(f.fileno()).st_size > _MMAP_THRESHOLD:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as view:
+                return blake3.blake3(view).hexdigest(length=16)
+        return blake3.blake3(f.read()).hexdigest(length=16)
+
+def hash_files(files: list[str], hash_fn: Callable[[str], str] = generate_md5) -> dict[str, str]:
+    """Hash *files* in a thread pool (hashlib/blake3 release the GIL); unreadable files are logged and left out."""
+    def _safe(file):
+        try:
+            return hash_fn(file)
+        except Exception as e:
+            print(f"[ERROR] Failed processing {file}: {e}")
+            return None
+
+    if not files:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(32, len(files))) as pool:
+        digests = list(pool.map(_safe, files))
+    return {file: digest for file, digest in zip(files, digests) if digest is not None}
+
 def clean_json_response(text):
     # Remove triple backtick code blocks (with or without 'json')
-    cleaned = re.sub(r'^```(?:json)?\s*|\s*```$', '', text.strip(), flags=re.IGNORECASE)
-    return cleaned.strip()
\ No newline at end of file
+    cleaned = _CODE_BLOCK_RE.sub('', text.strip())
+    return cleaned.strip()
+
+def split_prompt_template(template: str, schema_str: str) -> tuple[str, str]:
+    """Fill in {{SCHEMA}} and split the template around {{PAPER_TEXT}}.
+
+    Everything before the paper text is byte-identical across papers, so it is
+    sent as its own system message where the provider's prompt cache can hit.
+    """
+    prefix, _, suffix = template.replace("{{SCHEMA}}", schema_str).partition("{{PAPER_TEXT}}")
+    return prefix, suffix
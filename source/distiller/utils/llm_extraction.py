@@ -1,14 +1,31 @@
-import json, backoff, time
+import backoff, time
+import orjson
 from typing import Dict, Any, List
 from openai import OpenAI
 from pydantic import BaseModel, ValidationError
+from distiller.utils.concurrency import DEFAULT_MAX_WORKERS, run_bounded
 from distiller.utils.file_utils import clean_json_response
+from distiller.utils.schema_utils import model_json_schema
 from distiller.schemas.extraction_passes import AgentPropertyPass, AgentsPass, ExperimentPass, FormulationPass
 from anthropic import Anthropic
 from jinja2 import Environment, FileSystemLoader
-_jinja = Environment(loader=FileSystemLoader("source/prompts"))
+from pathlib import Path
+# resolved from this file, so templates load at import whatever the working directory
+_jinja = Environment(loader=FileSystemLoader(Path(__file__).resolve().parents[2] / "prompts"))
 import os
 
+# Built once: pydantic schema introspection and template lookup stay off the per-paper path.
+_SCHEMAS = {
+    model: model_json_schema(model)
+    for model in (AgentsPass, ExperimentPass, AgentPropertyPass, FormulationPass)
+}
+_TEMPLATES = {
+    "agent": _jinja.get_template("agent_prompt.j2"),
+    "experiment": _jinja.get_template("experiment_extraction/v4_experiment_prompt.j2"),
+    "agent_property": _jinja.get_template("molecule_extraction/v2_agent_property_prompt.j2"),
+    "formulation": _jinja.get_template("formulation_extraction/v5_formulation_prompt.j2"),
+}
+
 client = OpenAI(api_key=os.environ["OPENAI_API_KEY"])
 claude_client = Anthropic(api_key=os.environ["ANTHROPIC_API_KEY"])
 
@@ -33,7 +50,7 @@ def _llm_extract(
             print("[TRACE] Sending prompt to Claude with streaming...")
             
             # Use streaming for large responses
-            full_content = ""
+            parts: list[str] = []
             with claude_client.messages.stream(
                 model=model,
                 messages=messages,
@@ -41,7 +58,8 @@ def _llm_extract(
                 temperature=0,
             ) as stream:
                 for text in stream.text_stream:
-                    full_content += text
+                    parts.append(text)
+            full_content = "".join(parts)
 
             # Wrap response to mimic OpenAI's interface
             class _Msg:
@@ -59,14 +77,14 @@ def _llm_extract(
             raise ValueError(f"Unsupported model: {model}")
     for attempt in range(1, max_retries + 1):
         raw = _call(messages).choices[0].message.content
-        text = raw if isinstance(raw, str) else json.dumps(raw)
-        text = clean_json_response(text) if "clean_json_response" in globals() else text
+        text = raw if isinstance(raw, str) else orjson.dumps(raw).decode()
+        text = clean_json_response(text)
 
         try:
-            data = json.loads(text)
+            data = orjson.loads(text)
             parsed = schema_model.model_validate(data)     # <- strict validation
-            return json.loads(parsed.model_dump_json(by_alias=True))
-        except (json.JSONDecodeError, ValidationError) as err:
+            return parsed.model_dump(mode="json", by_alias=True)
+        except (orjson.JSONDecodeError, ValidationError) as err:
             if attempt == max_retries:
                 print(f"[ERROR] LLM output invalid after {max_retries} tries: {err}")
                 return None
@@ -83,38 +101,51 @@ def _llm_extract(
                 },
             ]
 def extract_agents(paper_text: str, llm_model: str) -> list[dict] | None:
-    prompt = _jinja.get_template("agent_prompt.j2").render(
-        PAPER_TEXT=paper_text, SCHEMA=AgentsPass.model_json_schema()
+    prompt = _TEMPLATES["agent"].render(
+        PAPER_TEXT=paper_text, SCHEMA=_SCHEMAS[AgentsPass]
     )
     return _llm_extract(prompt, AgentsPass, model=llm_model)
 
 def extract_experiments(paper_text: str, llm_model: str) -> list[dict] | None:
     """Run a single ExperimentPass over the full paper."""
-    prompt = _jinja.get_template("experiment_extraction/v4_experiment_prompt.j2").render(
+    prompt = _TEMPLATES["experiment"].render(
         PAPER_TEXT=paper_text,
-        SCHEMA=ExperimentPass.model_json_schema(),
+        SCHEMA=_SCHEMAS[ExperimentPass],
     )
     parsed = _llm_extract(prompt, ExperimentPass, model=llm_model)
     return parsed["experiments"] if parsed else None
 
 def extract_agent_properties(paper_text: str, llm_model: str) -> list[dict] | None:
-    prompt = _jinja.get_template("molecule_extraction/v2_agent_property_prompt.j2").render(
+    prompt = _TEMPLATES["agent_property"].render(
         PAPER_TEXT=paper_text,
-        SCHEMA=AgentPropertyPass.model_json_schema(),
+        SCHEMA=_SCHEMAS[AgentPropertyPass],
     )
     parsed = _llm_extract(prompt, AgentPropertyPass, model=llm_model)
     return parsed["properties"] if parsed else None
 
+def _extract_formulation_pass(paper_text: str, exp_id: str, llm_model: str) -> dict | None:
+    prompt = _TEMPLATES["formulation"].render(
+        PAPER_TEXT = paper_text,            # single prompt per exp
+        EXPERIMENT_ID = exp_id,
+        SCHEMA = _SCHEMAS[FormulationPass],
+    )
+    try:
+        return _llm_extract(prompt, FormulationPass, model=llm_model)
+    except Exception as e:
+        # one failed experiment must not discard the others
+        print(f"[ERROR] Formulation pass failed for experiment {exp_id}: {e}")
+        return None
+
 def extract_formulations(paper_text: str, experiments: list[dict], llm_model: str) -> list[dict]:
     all_forms: list[dict] = []
 
-    for exp in experiments:
-        prompt = _jinja.get_template("formulation_extraction/v5_formulation_prompt.j2").render(
-            PAPER_TEXT = paper_text,            # single prompt per exp
-            EXPERIMENT_ID = exp["id"],
-            SCHEMA = FormulationPass.model_json_schema(),
-        )
-        parsed = _llm_extract(prompt, FormulationPass, model=llm_model)
+    # The per-experiment calls are independent, so overlap their latency.
+    results = run_bounded(
+        _extract_formulation_pass,
+        ((paper_text, exp["id"], llm_model) for exp in experiments),
+        DEFAULT_MAX_WORKERS,
+    )
+    for exp, parsed in zip(experiments, results):
         if not parsed:
             continue
 
@@ -1,14 +1,30 @@
 from __future__ import annotations
 from urllib.parse import urlparse
+import codecs
 import os
 from pathlib import Path
 from typing import Any
-import tempfile
 import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
 from dotenv import load_dotenv
 load_dotenv()
 
 S3_TARGET_BUCKET = os.getenv("S3_TARGET_BUCKET")
+_S3_READ_CHUNK = 1 << 20  # 1 MiB
+
+# Ranged GETs of 8 MiB, 8 in flight: large PDFs download in parallel parts.
+_DOWNLOAD_CONFIG = TransferConfig(multipart_threshold=8 << 20, multipart_chunksize=8 << 20, max_concurrency=8)
+# Same split for uploads: 8 MiB parts, 10 in flight over the shared connection pool.
+_UPLOAD_CONFIG = TransferConfig(multipart_threshold=8 << 20, multipart_chunksize=8 << 20, max_concurrency=10, use_threads=True)
+
+# Shared by every module: one credential chain and one connection pool, sized for the
+# worker pools that fetch papers concurrently. boto3 clients are thread-safe, creating
+# them from the default session is not.
+GLOBAL_S3 = boto3.Session().client(
+    "s3",
+    config=Config(max_pool_connections=64, retries={"max_attempts": 10, "mode": "adaptive"}),
+)
 
 def get_s3_object_key(s3_uri: str) -> str | None:
     
@@ -16,12 +32,22 @@ def get_s3_object_key(s3_uri: str) -> str | None:
     key = parsed.path.lstrip("/")  # strip leading slash
     return key or None
 
-def get_s3_presigned_url(bucket_name: str, object_key: str):
+def read_s3_text(s3_client: Any, bucket: str, key: str, errors: str = "strict") -> str:
+    """Decode an S3 object chunk by chunk instead of holding the whole body as bytes and str."""
+    body = s3_client.get_object(Bucket=bucket, Key=key)["Body"]
+    decoder = codecs.getincrementaldecoder("utf-8")(errors=errors)
+    parts = [decoder.decode(chunk) for chunk in body.iter_chunks(chunk_size=_S3_READ_CHUNK)]
+    parts.append(decoder.decode(b"", final=True))
+    return "".join(parts)
 
-    s3_client = boto3.client('s3')
+def download_file_from_s3(bucket: str, object_key: str, file_path: str | Path) -> None:
+    """Download an object to *file_path*, splitting large objects into parallel byte-range GETs."""
+    GLOBAL_S3.download_file(bucket, object_key, str(file_path), Config=_DOWNLOAD_CONFIG)
+
+def get_s3_presigned_url(bucket_name: str, object_key: str):
 
     expiration = 3600
-    url = s3_client.generate_presigned_url(
+    url = GLOBAL_S3.generate_presigned_url(
         'get_object',
         Params={'Bucket': bucket_name, 'Key': object_key},
         ExpiresIn=expiration
@@ -29,45 +55,41 @@ def get_s3_presigned_url(bucket_name: str, object_key: str):
 
     return url
 
-def upload_fulltext_to_s3(fulltext: Any, object_key: str, bucket: str = S3_TARGET_BUCKET) -> str:
-    """Uploads a fulltext string to S3. Returns the s3:// URI of the uploaded file."""
+def _put_text_to_s3(text: str, object_key: str, bucket: str, content_type: str) -> str:
+    """Upload *text* as one object straight from memory. Returns the s3:// URI."""
+    if not bucket:
+        raise RuntimeError("S3 bucket not specified and S3_TARGET_BUCKET env var not set")
+    GLOBAL_S3.put_object(
+        Bucket=bucket,
+        Key=object_key,
+        Body=text.encode("utf-8"),
+        ContentType=f"{content_type}; charset=utf-8",
+    )
+    print(f"[TRACE] Uploaded file to S3: {object_key}")
+    return f"s3://{bucket}/{object_key}"
+
+def upload_fulltext_to_s3(fulltext: Any, object_key: str, bucket: str = S3_TARGET_BUCKET) -> tuple[str, str]:
+    """Uploads a fulltext string to S3. Returns the s3:// URI and the uploaded text."""
     if isinstance(fulltext, str):
         full_markdown = fulltext
     else:
         full_markdown = "\n\n".join(page.markdown for page in fulltext.pages)
 
-    with tempfile.NamedTemporaryFile(mode="w+", suffix=".txt", delete=False) as tmpfile:
-        tmpfile.write(full_markdown)
-        tmpfile_path = tmpfile.name
-
-    s3_uri = upload_file_to_s3(tmpfile_path, bucket=bucket, object_key=object_key)
-    os.remove(tmpfile_path)
-    return s3_uri
+    s3_uri = _put_text_to_s3(full_markdown, object_key, bucket, "text/plain")
+    return s3_uri, full_markdown
 
-def upload_mistral_fulltext_to_s3( ocr_response: Any, object_key: str, bucket: str = S3_TARGET_BUCKET) -> str:
-    """Extracts fulltext markdown from a Mistral OCR response object and uploads it to S3. Returns the s3:// URI of the uploaded file."""
+def upload_mistral_fulltext_to_s3( ocr_response: Any, object_key: str, bucket: str = S3_TARGET_BUCKET) -> tuple[str, str]:
+    """Extracts fulltext markdown from a Mistral OCR response object and uploads it to S3. Returns the s3:// URI and the joined markdown, so callers need not rebuild it from the pages."""
 
     full_markdown = "\n\n".join(page.markdown for page in ocr_response.pages)
-    with tempfile.NamedTemporaryFile(mode="w+", suffix=".md", delete=False) as tmpfile:
-        tmpfile.write(full_markdown)
-        tmpfile_path = tmpfile.name
+    s3_uri = _put_text_to_s3(full_markdown, object_key, bucket, "text/markdown")
 
-    s3_uri = upload_file_to_s3(tmpfile_path, bucket=bucket, object_key=object_key)
-    os.remove(tmpfile_path)
-
-    return s3_uri
+    return s3_uri, full_markdown
 
 
 def upload_llama_parse_fulltext_to_s3(fulltext: str, object_key: str, bucket: str = S3_TARGET_BUCKET) -> str:
     print(f"[TRACE][LLAMA-PARSE] Uploading fulltext to S3: {object_key}")
-    with tempfile.NamedTemporaryFile(mode="w+", suffix=".txt", delete=False) as tmpfile:
-        tmpfile.write(fulltext)
-        tmpfile_path = tmpfile.name
-
-    s3_uri = upload_file_to_s3(tmpfile_path, bucket=bucket, object_key=object_key)
-    os.remove(tmpfile_path)
-
-    return s3_uri
+    return _put_text_to_s3(fulltext, object_key, bucket, "text/plain")
 
 def upload_file_to_s3(file_path: str | Path, bucket: str = S3_TARGET_BUCKET, object_key: str | None = None) -> str:
     """Upload a file to S3. Returns S3 uri of the uploaded file."""
@@ -82,7 +104,6 @@ def upload_file_to_s3(file_path: str | Path, bucket: str = S3_TARGET_BUCKET, obj
     if object_key is None:
         object_key = f"raw/{file_path.name}"
 
-    s3_client = boto3.client("s3")
-    s3_client.upload_file(str(file_path), bucket, object_key)
+    GLOBAL_S3.upload_file(str(file_path), bucket, object_key, Config=_UPLOAD_CONFIG)
     print(f"[TRACE] Uploaded file to S3: {object_key}")
     return f"s3://{bucket}/{object_key}"
\ No newline at end of file
@@ -0,0 +1,33 @@
+from __future__ import annotations
+from functools import lru_cache
+from typing import Any, Callable
+
+import jsonschema
+
+try:
+    import fastjsonschema
+except ImportError:  # plain jsonschema still works, just slower
+    fastjsonschema = None
+
+# Catch this in place of jsonschema.ValidationError around a compiled validator.
+if fastjsonschema is not None:
+    SchemaValidationError: tuple[type[Exception], ...] = (
+        fastjsonschema.JsonSchemaException,
+        jsonschema.ValidationError,
+    )
+else:
+    SchemaValidationError = (jsonschema.ValidationError,)
+
+
+@lru_cache(maxsize=None)
+def model_json_schema(model: type) -> dict[str, Any]:
+    """Process-wide memo of ``model.model_json_schema()``; treat the result as read-only."""
+    return model.model_json_schema()
+
+
+def compile_schema_validator(schema: dict[str, Any]) -> Callable[[Any], Any]:
+    """Build a validator for *schema* once; call it per document instead of jsonschema.validate."""
+    if fastjsonschema is not None:
+        return fastjsonschema.compile(schema)
+    validator = jsonschema.validators.validator_for(schema)(schema)
+    return validator.validate
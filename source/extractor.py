@@ -1,7 +1,5 @@
-import json
+import orjson
 import os
-import re
-from jsonschema import validate, ValidationError
 from dotenv import load_dotenv
 import google.generativeai as genai
 import sys
@@ -11,6 +9,8 @@ from distiller.pmc.get_papers import get_papers_from_pmc
 from distiller.pmc.get_cpa_facts import get_cpa_facts_from_papers
 from pipelines.pipeline_orchestration import run_pipeline       
 from distiller.schemas.pipeline_config import PipelineConfig
+from distiller.utils.file_utils import clean_json_response, split_prompt_template
+from distiller.utils.schema_utils import SchemaValidationError, compile_schema_validator
 import nest_asyncio, asyncio, logging
 nest_asyncio.apply()                  # allows re‑entrancy
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
@@ -26,41 +26,42 @@ PROMPT_PATH = os.path.join(SCRIPT_DIR, 'gemini_prompt.txt')
 
 print("[TRACE] Loading JSON schema...")
 with open(SCHEMA_PATH) as f:
-    SCHEMA_OBJ = json.load(f)
-    SCHEMA_STR = json.dumps(SCHEMA_OBJ, indent=2)
+    SCHEMA_OBJ = orjson.loads(f.read())
+    SCHEMA_STR = orjson.dumps(SCHEMA_OBJ, option=orjson.OPT_INDENT_2).decode()
+VALIDATE = compile_schema_validator(SCHEMA_OBJ)
 
 print("[TRACE] Loading Gemini prompt template...")
 with open(PROMPT_PATH) as f:
     PROMPT_TEMPLATE = f.read()
-
-def clean_json_response(text):
-    # Remove triple backtick code blocks (with or without 'json')
-    cleaned = re.sub(r'^```(?:json)?\s*|\s*```$', '', text.strip(), flags=re.IGNORECASE)
-    return cleaned.strip()
+PROMPT_PREFIX, PROMPT_SUFFIX = split_prompt_template(PROMPT_TEMPLATE, SCHEMA_STR)
+MODEL = genai.GenerativeModel('gemini-2.5-pro', generation_config={"response_mime_type": "application/json"})
 
 def extract_text_from_pdf(pdf_path):
     print(f"[TRACE] Extracting text from PDF: {pdf_path}")
-    import pdfplumber
-    with pdfplumber.open(pdf_path) as pdf:
-        return "\n".join(page.extract_text() or "" for page in pdf.pages)
+    import pypdfium2 as pdfium
+    pdf = pdfium.PdfDocument(pdf_path)
+    try:
+        # PDFium ends lines with CRLF; normalise to match the old pdfplumber output
+        return "\n".join(page.get_textpage().get_text_range().replace("\r\n", "\n") for page in pdf)
+    finally:
+        pdf.close()
 
 def extract_paper_data(paper_text):
     print("[TRACE] Preparing prompt for Gemini...")
-    prompt = PROMPT_TEMPLATE.replace("{{SCHEMA}}", SCHEMA_STR).replace("{{PAPER_TEXT}}", paper_text)
+    prompt = "".join((PROMPT_PREFIX, paper_text, PROMPT_SUFFIX))
     print("[TRACE] Sending prompt to Gemini...")
-    model = genai.GenerativeModel('gemini-2.5-pro')
-    response = model.generate_content(prompt)
+    response = MODEL.generate_content(prompt)
     print("[TRACE] Received response from Gemini. Parsing JSON...")
     # Extract the model's response text
     try:
         text = response.text.strip()
         text = clean_json_response(text)
-        data = json.loads(text)
+        data = orjson.loads(text)
         print("[TRACE] Validating response against schema...")
-        validate(instance=data, schema=SCHEMA_OBJ)
+        VALIDATE(data)
         print("[TRACE] Validation successful.")
         return data
-    except (json.JSONDecodeError, ValidationError) as e:
+    except (orjson.JSONDecodeError, *SchemaValidationError) as e:
         print("[ERROR] Error extracting or validating data:", e)
         print("[ERROR] Raw model output:", getattr(response, 'text', str(response)))
         return None
@@ -97,6 +98,6 @@ if __name__ == "__main__":
         extracted = extract_paper_data(paper_text)
         if extracted:
             print("[TRACE] Extraction and validation complete. Outputting JSON...")
-            print(json.dumps(extracted, indent=2))
+            print(orjson.dumps(extracted, option=orjson.OPT_INDENT_2).decode())
         else:
             print("[ERROR] Extraction failed.") 
\ No newline at end of file
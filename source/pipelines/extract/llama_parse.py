@@ -1,38 +1,92 @@
 from distiller.llama_parse.extractor import extract_text_from_s3
-from distiller.utils.file_utils import generate_md5
-from distiller.utils.db_utils import hash_in_psql
+from distiller.utils.file_utils import generate_content_hash, generate_md5, hash_files
+from distiller.utils.db_utils import existing_hashes
 from distiller.utils.s3_utils import upload_file_to_s3, upload_fulltext_to_s3
 from distiller.schemas.papers import Paper, PaperStatus
 from distiller.postgres_connection import connection_ctx
 from pipelines.utils.paper_utils import add_paper_to_db, update_metadata_from_fulltext, get_cpa_facts_from_fulltext
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
-from typing import Iterator, Tuple
+from typing import Iterator, Optional, Tuple
 
-def extract_fulltext(files: list[str], source_files: str) -> Iterator[Tuple[str, str]]:
+# "blake3" checks papers.content_hash first and only computes the MD5 key for new files.
+DEDUP_HASH = os.getenv("DEDUP_HASH", "md5").lower()
+
+_MAX_WORKERS = 8
+# Uploads may all run at once, but only a few LlamaParse jobs run concurrently.
+_PARSE_SLOTS = threading.BoundedSemaphore(4)
+
+def _new_files(files: list[str], cur) -> list[Tuple[str, str, Optional[str]]]:
+    """Hash *files* and drop those already in psql, with one lookup per hash column."""
+    content_hashes: dict[str, str] = {}
+    if DEDUP_HASH == "blake3":
+        content_hashes = hash_files(files, generate_content_hash)
+        seen = existing_hashes(content_hashes.values(), cur, column="content_hash")
+        files = []
+        for file, content_hash in content_hashes.items():
+            if content_hash in seen:
+                print(f"[TRACE] Skipping file {file} as it is already in psql")
+            else:
+                files.append(file)
+
+    md5_hashes = hash_files(files, generate_md5)
+    seen = existing_hashes(md5_hashes.values(), cur)
+    new_files = []
+    for file, file_md5_hash in md5_hashes.items():
+        if file_md5_hash in seen:
+            print(f"[TRACE] Skipping file {file} as it is already in psql")
+            continue
+        seen.add(file_md5_hash)  # same content twice in one batch
+        new_files.append((file, file_md5_hash, content_hashes.get(file)))
+    return new_files
+
+def _ingest_file(file: str, file_md5_hash: str, content_hash: Optional[str], source_files: str) -> Optional[Tuple[str, str]]:
+    """Upload, parse and register one file; runs in a worker thread."""
+    try:
+        s3_uri = upload_file_to_s3(file, object_key=f"raw/{file_md5_hash}.pdf")
+        with _PARSE_SLOTS:
+            fulltext = extract_text_from_s3(s3_uri)
+        fulltext_s3_uri, fulltext = upload_fulltext_to_s3(fulltext, object_key=f"processed/{file_md5_hash}.txt")
+        paper = Paper(
+            source=source_files,
+            md5_hash=file_md5_hash,
+            content_hash=content_hash,
+            file_s3_uri=s3_uri,
+            fulltext_s3_uri=fulltext_s3_uri,
+            file_size_bytes=os.path.getsize(file),
+            status=PaperStatus.DOWNLOADED,
+            created_at=datetime.now(),
+        )
+    except Exception as e:
+        print(f"[ERROR] Failed processing {file}: {e}")
+        return None
+
+    # only the insert holds a pooled connection, not the slow parse
+    with connection_ctx() as conn, conn.cursor() as cur:
+        try:
+            add_paper_to_db(paper, cur)
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            print(f"[ERROR] Failed processing {file}: {e}")
+            return None
+    return (file_md5_hash, fulltext)
+
+def extract_fulltext(files: list[str], source_files: str, max_workers: int = _MAX_WORKERS) -> Iterator[Tuple[str, str]]:
     print(f"[TRACE][LLAMA-PARSE] Extracting full text from PDFs: {files}")
     with connection_ctx() as conn, conn.cursor() as cur:
-        for file in files:
-            try:
-                file_md5_hash = generate_md5(file)
-                if hash_in_psql(file_md5_hash, cur):
-                    print(f"[TRACE] Skipping file {file} as it is already in psql")
-                    continue
-                s3_uri = upload_file_to_s3(file, object_key=f"raw/{file_md5_hash}.pdf")
-                fulltext = extract_text_from_s3(s3_uri)
-                fulltext_s3_uri = upload_fulltext_to_s3(fulltext, object_key=f"processed/{file_md5_hash}.txt")
-                paper = Paper(
-                    source=source_files,
-                    md5_hash=file_md5_hash,
-                    file_s3_uri=s3_uri,
-                    fulltext_s3_uri=fulltext_s3_uri,
-                    file_size_bytes=os.path.getsize(file),
-                    status=PaperStatus.DOWNLOADED,
-                    created_at=datetime.now(),
-                )
-                add_paper_to_db(paper, cur)
-                conn.commit()
-                yield (file_md5_hash, fulltext)
-            except Exception as e:
-                conn.rollback()
-                print(f"[ERROR] Failed processing {file}: {e}")
+        new_files = _new_files(files, cur)
+
+    # Files move through upload -> LlamaParse -> upload -> insert independently, so
+    # one file's upload overlaps another's parse; results come out as they finish.
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = [
+            pool.submit(_ingest_file, file, file_md5_hash, content_hash, source_files)
+            for file, file_md5_hash, content_hash in new_files
+        ]
+        for future in as_completed(futures):
+            result = future.result()
+            if result is not None:
+                yield result
@@ -2,26 +2,47 @@
 Python‑only merge from MoleculeCoreData JSON → live tables.
 
 Depends on:
-    • distiller.postgres_connection.cursor_ctx
-    • pipelines.utils.embeddings.get_embedding
+    • distiller.postgres_connection.shared_cursor_ctx
+    • pipelines.utils.embeddings.get_embeddings_batch
 """
 from __future__ import annotations
 from typing import Iterable
-import re
-from distiller.postgres_connection import cursor_ctx
+import logging
+import math
+from pgvector import Vector
+from distiller.postgres_connection import shared_cursor_ctx
 from distiller.schemas.extraction_passes import MoleculeCoreData
-from pipelines.utils.embeddings import get_embedding
+from pipelines.utils.embeddings import get_embeddings_batch
+
+log = logging.getLogger(__name__)
 
 SIMILARITY_THRESHOLD = 0.38
-_INCHI_RE = re.compile(r"^[A-Z]{14}-[A-Z]{10}-[A-Z]$")
+
+
+def _is_inchikey(s: str) -> bool:
+    """Fixed 14-10-1 layout of upper-case ASCII letters, checked without the regex engine."""
+    return (
+        len(s) == 27
+        and s[14] == "-"
+        and s[25] == "-"
+        and s.count("-") == 2
+        and s.isascii()
+        and s.isupper()
+        and s.replace("-", "").isalpha()
+    )
 
 # ── SQL snippets ─────────────────────────────────────────────────
-_SQL_NEAREST_ALIAS = """
-SELECT chemical_id,
-       embedding <-> (%(qvec)s)::vector AS dist
-  FROM cpa_chemical_aliases
- ORDER BY embedding <-> (%(qvec)s)::vector
- LIMIT 1;
+# Nearest alias for every query vector of the batch in one round-trip
+_SQL_NEAREST_ALIASES = """
+SELECT q.idx, a.chemical_id, a.dist
+  FROM unnest(%s::vector[]) WITH ORDINALITY AS q(v, idx)
+ CROSS JOIN LATERAL (
+        SELECT chemical_id,
+               embedding <-> q.v AS dist
+          FROM cpa_chemical_aliases
+         ORDER BY embedding::halfvec(3072) <-> q.v::halfvec(3072)
+         LIMIT 1
+       ) a;
 """
 
 
@@ -44,47 +65,127 @@ ON CONFLICT (preferred_name) DO UPDATE
 RETURNING id;
 """
 
-_SQL_INSERT_ALIAS = """
+# Aliases of the whole batch are COPYed into a temp table, then merged in one
+# statement so ON CONFLICT DO NOTHING still applies.
+_SQL_CREATE_TMP_ALIAS = """
+CREATE TEMP TABLE tmp_aliases (
+    chemical_id  UUID,
+    alias        TEXT,
+    embedding    FLOAT8[],
+    is_preferred BOOLEAN
+) ON COMMIT DROP;
+"""
+
+_SQL_COPY_TMP_ALIAS = """
+COPY tmp_aliases (chemical_id, alias, embedding, is_preferred) FROM STDIN WITH (FORMAT BINARY)
+"""
+
+_SQL_MERGE_ALIAS = """
 INSERT INTO cpa_chemical_aliases
     (chemical_id, alias, embedding, is_preferred)
-VALUES (%s, %s, %s, %s)
+SELECT chemical_id, alias, embedding::vector, is_preferred
+  FROM tmp_aliases
+ ORDER BY lower(alias)
 ON CONFLICT DO NOTHING;
 """
 
+
+def _nearest_aliases(cur, qvecs: list[list[float]]) -> list[dict | None]:
+    """Closest alias row (chemical_id, dist) per query vector, None where the table is empty."""
+    hits: list[dict | None] = [None] * len(qvecs)
+    if not qvecs:
+        return hits
+    cur.execute(_SQL_NEAREST_ALIASES, ([Vector(v) for v in qvecs],))
+    for row in cur.fetchall():
+        hits[row["idx"] - 1] = row
+    return hits
+
+
+def _insert_aliases(cur, alias_rows: list[tuple]) -> None:
+    """Bulk-insert (chemical_id, alias, embedding, is_preferred) rows, skipping existing aliases."""
+    if not alias_rows:
+        return
+    cur.execute(_SQL_CREATE_TMP_ALIAS)
+    with cur.copy(_SQL_COPY_TMP_ALIAS) as copy:
+        copy.set_types(["uuid", "text", "float8[]", "bool"])
+        for row in alias_rows:
+            copy.write_row(row)
+    cur.execute(_SQL_MERGE_ALIAS)
+    cur.execute("DROP TABLE tmp_aliases;")  # the caller's transaction may merge again
+
 # ── main entry point ────────────────────────────────────────────
-def merge_agents(rows: Iterable[dict]) -> int:
+def agent_names(rows: Iterable[dict]) -> list[str]:
+    """Canonical preferred names and synonyms of raw agent rows (embedding keys)."""
+    return [
+        name.lower().strip()
+        for raw in rows
+        for name in [raw.get("preferred_name"), *(raw.get("synonyms") or [])]
+        if isinstance(name, str)  # malformed rows fail validation in merge_agents
+    ]
+
+
+def merge_agents(rows: Iterable[dict], cur=None, vecs: dict | None = None) -> int:
     """
     Upsert a batch of MoleculeCoreData rows.
 
+    Pass a dict_row *cur* to run inside the caller's transaction; otherwise
+    the batch commits on its own pooled connection.  *vecs* are embeddings
+    fetched beforehand (see agent_names), so no API call runs under the
+    caller's row locks; any name missing from it is fetched here.
+
     Returns
     -------
     int
         Number of agent JSON objects processed (for logging/metrics).
     """
     processed = 0
+    alias_rows: list[tuple] = []
+
+    agents = []
+    debug = log.isEnabledFor(logging.DEBUG)
+    for raw in rows:
+        if debug:
+            log.debug("RAW: %s", raw)
+        agents.append(MoleculeCoreData.model_validate(raw))
+    # Same upsert order in every transaction, so concurrent papers introducing
+    # the same chemicals queue on the row locks instead of deadlocking.
+    agents.sort(key=lambda a: (a.inchikey or "", a.preferred_name.lower()))
 
-    with cursor_ctx(commit=True) as cur:
-        for raw in rows:
-            print("RAW: ", raw)
-            agent = MoleculeCoreData.model_validate(raw)
+    # One embedding request for every name in the batch instead of one per alias
+    emb_cache = dict(vecs or {})
+    missing = [
+        name.lower().strip()
+        for agent in agents
+        for name in [agent.preferred_name, *agent.synonyms]
+        if name.lower().strip() not in emb_cache
+    ]
+    if missing:
+        emb_cache.update(get_embeddings_batch(missing))
 
-            # 1. Find closest alias
-            qvec = get_embedding(agent.preferred_name.lower().strip())
-            cur.execute(_SQL_NEAREST_ALIAS, {"qvec": qvec})
-            hit = cur.fetchone()
+    qvecs = [emb_cache[agent.preferred_name.lower().strip()] for agent in agents]
+
+    with shared_cursor_ctx(cur) as cur:
+        # 1. Find closest alias for every agent at once
+        nearest = _nearest_aliases(cur, qvecs)
+        for agent, qvec, hit in zip(agents, qvecs, nearest):
+            # Aliases queued earlier in this batch are not in the table yet;
+            # compare against them too so near-duplicate names still merge.
+            best_dist, chem_id = (hit["dist"], hit["chemical_id"]) if hit else (math.inf, None)
+            for queued_chem_id, _, queued_vec, _ in alias_rows:
+                dist = math.dist(qvec, queued_vec)
+                if dist < best_dist:
+                    best_dist, chem_id = dist, queued_chem_id
 
             # 2. Choose insert strategy
-            if hit and hit["dist"] < SIMILARITY_THRESHOLD:
-                chem_id = hit["chemical_id"]
-            else:
-                if agent.inchikey and _INCHI_RE.match(agent.inchikey):
+            if best_dist >= SIMILARITY_THRESHOLD:
+                if agent.inchikey and _is_inchikey(agent.inchikey):
                     cur.execute(
                         _SQL_INSERT_CHEM,
                         dict(
                             inchikey=agent.inchikey,
                             pref=agent.preferred_name,
                             role=agent.role.value,
-                            emb=qvec,
+                            emb=Vector(qvec),
                         ),
                     )
                 else:
@@ -93,26 +194,27 @@ def merge_agents(rows: Iterable[dict]) -> int:
                         dict(
                             pref=agent.preferred_name,
                             role=agent.role.value,
-                            emb=qvec,
+                            emb=Vector(qvec),
                         ),
                     )
                 chem_id = cur.fetchone()["id"]
 
-            # 3. Insert aliases in bulk with executemany
-            alias_rows = [
+            # 3. Queue aliases; written for the whole batch below
+            alias_rows.extend(
                 (
                     chem_id,
                     name,
-                    get_embedding(name.lower().strip()),
+                    emb_cache[name.lower().strip()],
                     is_pref,
                 )
                 for name, is_pref in (
                     [(agent.preferred_name, True)]
                     + [(s, False) for s in agent.synonyms]
                 )
-            ]
-            cur.executemany(_SQL_INSERT_ALIAS, alias_rows)
+            )
 
             processed += 1
 
+        _insert_aliases(cur, alias_rows)
+
     return processed
\ No newline at end of file
@@ -2,34 +2,39 @@
 COPY raw JSON rows into a staging table.
 
 Relies on:
-    • distiller.postgres_connection.cursor_ctx
+    • distiller.postgres_connection.shared_cursor_ctx
     • psycopg 3.1+
 """
 from __future__ import annotations
-import io, json
+import orjson
 from psycopg import sql
-from distiller.postgres_connection import cursor_ctx
+from distiller.postgres_connection import shared_cursor_ctx
 
 
-def copy_json(rows: list[dict], staging_table: str) -> None:
+def json_copy_line(row: dict) -> bytes:
+    """One row for COPY's text format: minified JSON, backslashes doubled, newline-terminated."""
+    # orjson escapes control characters itself, so the backslash is the only COPY escape left
+    return orjson.dumps(row).replace(b"\\", b"\\\\") + b"\n"
+
+
+def copy_json(rows: list[dict], staging_table: str, cur=None) -> None:
     """
     Bulk‑insert a list of JSON‑serialisable dicts into `<staging_table>`,
-    using `COPY … FROM STDIN` for maximum throughput.
+    using `COPY … FROM STDIN` for maximum throughput. With *cur* the rows
+    join the caller's transaction instead of committing separately.
     """
     if rows == []:
         raise Exception("No rows to copy")
     if not rows:
         return
 
-    # Minified newline‑separated JSON for COPY
-    payload = "\n".join(json.dumps(r, separators=(",", ":")) for r in rows)
-
-    with cursor_ctx(commit=True) as cur:
+    with shared_cursor_ctx(cur) as cur:
         # Safely quote the table name
         stmt = sql.SQL("COPY {} (data_json) FROM STDIN").format(
             sql.Identifier(staging_table)
         )
 
-        # Context‑manager copy object
+        # Context‑manager copy object; rows are serialised while COPY streams
         with cur.copy(stmt) as copy:
-            copy.write(payload) 
\ No newline at end of file
+            for r in rows:
+                copy.write(json_copy_line(r)) 
\ No newline at end of file
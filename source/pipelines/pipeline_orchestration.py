@@ -1,9 +1,10 @@
 from pipelines.extract.llama_parse import extract_fulltext as extract_fulltext_llama_parse
 from pipelines.utils.paper_utils import update_metadata_from_fulltext
 from pipelines.utils.pipeline_utils import update_workflow_status
-from pipelines.post_processing.agent_property_ingest import insert_agent_properties
+from pipelines.post_processing.agent_property_ingest import insert_agent_properties, property_labels
 from pipelines.post_processing.experiment_ingest import insert_experiments
 from pipelines.post_processing.formulation_ingest import insert_formulations   # NEW
+from distiller.postgres_connection import cursor_ctx
 from distiller.schemas.pipeline_config import PipelineConfig
 from distiller.utils.llm_extraction import (
     extract_agents,
@@ -12,10 +13,13 @@ from distiller.utils.llm_extraction import (
     extract_formulations,                                            # NEW
 )
 from pipelines.ingest.staging import copy_json
-from pipelines.ingest.merge_agents import merge_agents
+from pipelines.ingest.merge_agents import agent_names, merge_agents
+from pipelines.utils.embeddings import get_embeddings_batch
 # ── timing helper  (put near the top of your file) ──────────────────
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
-import time, logging
+import random, time, logging
+from psycopg.errors import DeadlockDetected, SerializationFailure
 from distiller.schemas.papers import PaperStatus
 
 logging.basicConfig(
@@ -23,6 +27,7 @@ logging.basicConfig(
     format="%(asctime)s  %(levelname)-8s  %(message)s",
     datefmt="%H:%M:%S",
 )
+log = logging.getLogger(__name__)
 @contextmanager
 def timed(label: str):
     t0 = time.perf_counter()
@@ -33,88 +38,122 @@ def timed(label: str):
         logging.info(f"[TIMER] {label:<35} {dt:6.2f} s")
 
 
-def run_pipeline(files: list[str], source_files: str, config: PipelineConfig):
-
-    if config.distiller == "llama_parse" and config.llm_model_parser == "gpt-4.1-mini":
-        for md5_hash, fulltext in extract_fulltext_llama_parse(files, source_files):
-            with timed("0‑update_metadata"):
-                paper_id = update_metadata_from_fulltext(md5_hash, fulltext)
-                if paper_id is None:
-                    print(f"[ERROR] Failed to update metadata for {md5_hash}")
-                    update_workflow_status(md5_hash, PaperStatus.FAILED)
-                    continue
-
-        # ── Agents ───────────────────────────────────────────────
-            with timed("1‑extract_agents"):
-                agents = extract_agents(fulltext)
-                if agents is None:
-                    print(f"[ERROR] Failed to extract agents for {md5_hash}")
-                    update_workflow_status(md5_hash, PaperStatus.FAILED)
-                    continue
-            with timed("1a‑merge_agents"):
-                agent_rows = agents.get("agents", [])
-                if agent_rows:
-                    copy_json(agent_rows, "staging_cpa_chemicals")
-                    merge_agents(agent_rows)
-
-        # ── Agent‑level props ───────────────────────────────────
-            with timed("2‑extract_agent_props"):
-                props = extract_agent_properties(fulltext)
-            with timed("2a‑insert_agent_props"):
-                if props:
-                    insert_agent_properties(paper_id, props)
-
-        # ── Experiments ─────────────────────────────────────────
-            with timed("3‑extract_experiments"):
-                experiments = extract_experiments(fulltext)
-            with timed("3a‑insert_experiments"):
-                if experiments is not None:
-                    print(f'[TRACE] experiments: {experiments}')
-                    insert_experiments(md5_hash, experiments)
-                    with timed("4‑extract_formulations"):
-                        formulations = extract_formulations(fulltext,experiments)
-                    with timed("4a‑insert_formulations"):
-                        if formulations:
-                            print(f'[TRACE] formulations: {formulations}')
-                            insert_formulations(md5_hash, formulations, experiments)
-                else:
-                    print(f"[ERROR] Failed to extract experiments for {md5_hash}")
-                    update_workflow_status(md5_hash, PaperStatus.FAILED)
-
-    if config.distiller == "llama_parse" and config.llm_model_parser == "claude-sonnet-4-20250514":
-
-        for md5_hash, fulltext in extract_fulltext_llama_parse(files, source_files):
-            paper_id = update_metadata_from_fulltext(md5_hash, fulltext)
-            if paper_id is None:
-                print(f"[ERROR] Failed to update metadata for {md5_hash}")
-                update_workflow_status(md5_hash, PaperStatus.FAILED)
-                continue
-
-        # ── Agents ───────────────────────────────────────────────
-            agents = extract_agents(fulltext, llm_model=config.llm_model_parser)
-            if agents is None:
-                print(f"[ERROR] Failed to extract agents for {md5_hash}")
-                update_workflow_status(md5_hash, PaperStatus.FAILED)
-                continue
-            
-            print(f'[TRACE] agents: {agents}')
+MAX_CONCURRENT_PAPERS = 4  # each paper fans out its own formulation calls as well
+
+# Agents, agent properties and experiments only need the fulltext, so a paper
+# submits all three at once; formulations still wait for the experiments.
+_PASS_POOL = ThreadPoolExecutor(max_workers=3 * MAX_CONCURRENT_PAPERS)
+
+
+def _timed_call(label: str, fn, *args, **kwargs):
+    with timed(label):
+        return fn(*args, **kwargs)
+
+
+_WRITE_ATTEMPTS = 3  # concurrent papers can deadlock on the same new chemicals
+
+def _retry_on_conflict(md5_hash: str, fn, *args, **kwargs):
+    """Run a write transaction, re-running it after a deadlock / serialization abort."""
+    for attempt in range(1, _WRITE_ATTEMPTS + 1):
+        try:
+            return fn(*args, **kwargs)
+        except (DeadlockDetected, SerializationFailure) as e:
+            if attempt == _WRITE_ATTEMPTS:
+                raise
+            log.warning("write for %s aborted (%s); retry %d/%d",
+                        md5_hash, type(e).__name__, attempt, _WRITE_ATTEMPTS - 1)
+            time.sleep(random.uniform(0.05, 0.25) * attempt)  # de-synchronise the racers
+
+
+def _write_passes(md5_hash: str, paper_id, agents: dict, props, experiments, vecs: dict) -> None:
+    """Agents, properties and experiments of one paper in a single transaction."""
+    with cursor_ctx(commit=True) as cur:
+        # ── Agents ───────────────────────────────────────────
+        with timed("1a‑merge_agents"):
             agent_rows = agents.get("agents", [])
+            log.debug("merging %d agents for %s", len(agent_rows), md5_hash)
             if agent_rows:
-                copy_json(agent_rows, "staging_cpa_chemicals")
-                merge_agents(agent_rows)
-        # ── Agent‑level props ───────────────────────────────────
-            props = extract_agent_properties(fulltext, llm_model=config.llm_model_parser)
+                copy_json(agent_rows, "staging_cpa_chemicals", cur=cur)
+                merge_agents(agent_rows, cur=cur, vecs=vecs)
+
+        # ── Agent‑level props ───────────────────────────────
+        with timed("2a‑insert_agent_props"):
             if props:
-                insert_agent_properties(paper_id, props)
-        # ── Experiments ─────────────────────────────────────────
-            experiments = extract_experiments(fulltext, llm_model=config.llm_model_parser)
-            if experiments is not None:
-                print(f'[TRACE] experiments: {experiments}')
-                insert_experiments(md5_hash, experiments)
-                formulations = extract_formulations(fulltext,experiments, llm_model=config.llm_model_parser)
-                if formulations:
-                    print(f'[TRACE] formulations: {formulations}')
-                    insert_formulations(md5_hash, formulations, experiments)
-                else:
-                    print(f"[ERROR] Failed to extract formulations for {md5_hash}")
-                    update_workflow_status(md5_hash, PaperStatus.FAILED)
\ No newline at end of file
+                insert_agent_properties(paper_id, props, cur=cur, vecs=vecs)
+
+        # ── Experiments ─────────────────────────────────────
+        if experiments is not None:
+            with timed("3a‑insert_experiments"):
+                log.debug("inserting %d experiments for %s", len(experiments), md5_hash)
+                insert_experiments(md5_hash, experiments, cur=cur)
+
+
+def _process_paper(md5_hash: str, fulltext: str, llm_model: str) -> None:
+    """Metadata, agents, properties, experiments and formulations for one paper."""
+    with timed("0‑update_metadata"):
+        paper_id = update_metadata_from_fulltext(md5_hash, fulltext)
+        if paper_id is None:
+            print(f"[ERROR] Failed to update metadata for {md5_hash}")
+            update_workflow_status(md5_hash, PaperStatus.FAILED)
+            return
+
+    agents_f = _PASS_POOL.submit(_timed_call, "1‑extract_agents", extract_agents, fulltext, llm_model=llm_model)
+    props_f = _PASS_POOL.submit(_timed_call, "2‑extract_agent_props", extract_agent_properties, fulltext, llm_model=llm_model)
+    experiments_f = _PASS_POOL.submit(_timed_call, "3‑extract_experiments", extract_experiments, fulltext, llm_model=llm_model)
+
+    agents = agents_f.result()
+    if agents is None:
+        print(f"[ERROR] Failed to extract agents for {md5_hash}")
+        update_workflow_status(md5_hash, PaperStatus.FAILED)
+        return
+    props = props_f.result()
+    experiments = experiments_f.result()
+
+    # All three passes are in hand, so their rows go in on one pooled
+    # connection and commit together; no connection is held during LLM calls.
+    # Embeddings for every agent name and property label are fetched before the
+    # transaction opens, so no API round trip runs while chemical rows are locked.
+    with timed("1b‑embed_names"):
+        vecs = get_embeddings_batch(
+            agent_names(agents.get("agents", [])) + property_labels(props or [])
+        )
+    _retry_on_conflict(md5_hash, _write_passes, md5_hash, paper_id, agents, props, experiments, vecs)
+
+    if experiments is None:
+        print(f"[ERROR] Failed to extract experiments for {md5_hash}")
+        update_workflow_status(md5_hash, PaperStatus.FAILED)
+        return
+
+    # ── Formulations ────────────────────────────────────────
+    with timed("4‑extract_formulations"):
+        formulations = extract_formulations(fulltext, experiments, llm_model=llm_model)
+    if not formulations:
+        print(f"[ERROR] Failed to extract formulations for {md5_hash}")
+        update_workflow_status(md5_hash, PaperStatus.FAILED)
+        return
+    with timed("4a‑insert_formulations"):
+        log.debug("inserting %d formulations for %s", len(formulations), md5_hash)
+        _retry_on_conflict(md5_hash, insert_formulations, md5_hash, formulations, experiments)
+
+
+def _process_paper_safe(md5_hash: str, fulltext: str, llm_model: str) -> None:
+    # one failing paper must not stop the others in the pool
+    try:
+        _process_paper(md5_hash, fulltext, llm_model)
+    except Exception as e:
+        print(f"[ERROR] Pipeline failed for {md5_hash}: {e}")
+        update_workflow_status(md5_hash, PaperStatus.FAILED)
+
+
+def run_pipeline(files: list[str], source_files: str, config: PipelineConfig,
+                 max_workers: int = MAX_CONCURRENT_PAPERS):
+
+    if config.distiller != "llama_parse":
+        raise ValueError(f"Unsupported distiller: {config.distiller}")
+
+    # Papers are handed to the pool as soon as LlamaParse yields them, so parsing
+    # the next file overlaps with the LLM passes of the previous ones.
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        papers = extract_fulltext_llama_parse(files, source_files)
+        # list() drains the iterator so worker exceptions are not silently dropped
+        list(pool.map(lambda paper: _process_paper_safe(*paper, config.llm_model_parser), papers))
@@ -12,22 +12,34 @@ Resolution strategy
 
 from __future__ import annotations
 
-import json
-import re
+import logging
+import orjson
 from typing import List, Dict, Any, Tuple
-from uuid import UUID
+from uuid import UUID, uuid4
 
-from distiller.postgres_connection import cursor_ctx
-from pipelines.utils.embeddings import get_embedding  # same helper you use elsewhere
+from pgvector import Vector
+
+from distiller.postgres_connection import shared_cursor_ctx
+from distiller.schemas.cpa_chemical import PROPERTY_VALUE_COLUMNS
+from pipelines.utils.embeddings import get_embeddings_batch
 from pipelines.utils.embeddings import SIMILARITY_THRESHOLD
 
+log = logging.getLogger(__name__)
+
 # ----------------------------------------------------------------------
 # helpers identical to ingest-CPA code (kept local to avoid circular deps)
 # ----------------------------------------------------------------------
-_INCHI_PAT = re.compile(r"^[A-Z]{14}-[A-Z]{10}-[A-Z]$", re.I)
-
 def _is_valid_inchikey(k: str | None) -> bool:
-    return bool(k and _INCHI_PAT.match(k))
+    """14-10-1 blocks of ASCII letters (either case), checked without the regex engine."""
+    return bool(
+        k
+        and len(k) == 27
+        and k[14] == "-"
+        and k[25] == "-"
+        and k.count("-") == 2
+        and k.isascii()
+        and k.replace("-", "").isalpha()
+    )
 
 def _canon(text: str) -> str:
     return text.strip().lower()
@@ -36,47 +48,119 @@ def _canon(text: str) -> str:
 # ----------------------------------------------------------------------
 # value-mapping helper
 # ----------------------------------------------------------------------
-def _value_kind_and_columns(val: Any) -> Tuple[str, Dict[str, Any]]:
+def _value_columns(val: Any) -> Tuple[str, Any, Any, Any, Any, Any]:
+    """(value_kind, numeric_value, range_min, range_max, raw_value, extra), None where unused."""
     if isinstance(val, (int, float)):
-        return "POINT", {"numeric_value": val}
+        return "POINT", val, None, None, None, None
     if isinstance(val, str):
-        return "RAW", {"raw_value": val}
+        return "RAW", None, None, None, val, None
 
     vtype = val.get("value_type")
     if vtype == "point":
-        return "POINT", {"numeric_value": val["value"]}
+        return "POINT", val["value"], None, None, None, None
     if vtype == "range":
-        return "RANGE", {"range_min": val["min"], "range_max": val["max"]}
+        return "RANGE", None, val["min"], val["max"], None, None
 
-    return "STRUCT", {"extra": json.dumps(val)}
+    return "STRUCT", None, None, None, None, orjson.dumps(val).decode()
 
 
 # ----------------------------------------------------------------------
 # chemical resolution (InChIKey ► exact  ·  name ► embedding)
 # ----------------------------------------------------------------------
-_EMBED_SQL = """
-SELECT chemical_id, alias, embedding <-> %s::vector AS dist
-FROM   cpa_chemical_aliases
-ORDER  BY dist
-LIMIT  1;
+# One round-trip for every label: each query vector probes the alias index
+# server-side and keeps its single nearest alias.
+_SQL_NEAREST_ALIASES = """
+SELECT q.idx, a.chemical_id, a.dist
+  FROM unnest(%s::vector[]) WITH ORDINALITY AS q(v, idx)
+ CROSS JOIN LATERAL (
+        SELECT chemical_id,
+               embedding <-> q.v AS dist
+          FROM cpa_chemical_aliases
+         ORDER BY embedding::halfvec(3072) <-> q.v::halfvec(3072)
+         LIMIT 1
+       ) a;
 """
 
-def _resolve_chemical_id(cur, inchikey: str | None, label: str) -> UUID | None:
-    # 1. exact InChIKey
-    if _is_valid_inchikey(inchikey):
-        cur.execute("SELECT id FROM cpa_chemicals WHERE inchikey = %s;", (inchikey,))
-        row = cur.fetchone()
-        if row:
-            return row["id"]
+def property_labels(props: List[Dict[str, Any]]) -> List[str]:
+    """Canonical agent labels of *props* (embedding keys for alias matching)."""
+    return [_canon(p["agent_label"]) for p in props]
+
+
+def _resolve_chemical_ids(
+    cur, props: List[Dict[str, Any]], vecs: Dict[str, Any] | None = None
+) -> List[UUID | None]:
+    """Chemical id per property (None if unresolved), batched over the whole list."""
+    chem_ids: List[UUID | None] = [None] * len(props)
+
+    # 1. exact InChIKey, one lookup for all keys
+    keys = {p.get("agent_id") for p in props if _is_valid_inchikey(p.get("agent_id"))}
+    if keys:
+        cur.execute(
+            "SELECT inchikey, id FROM cpa_chemicals WHERE inchikey = ANY(%s);",
+            (list(keys),),
+        )
+        by_key = {row["inchikey"]: row["id"] for row in cur.fetchall()}
+        for i, p in enumerate(props):
+            chem_ids[i] = by_key.get(p.get("agent_id"))
+
+    # 2. semantic alias match for the rest, one kNN query for all labels
+    pending: Dict[str, List[int]] = {}
+    for i, p in enumerate(props):
+        if chem_ids[i] is None:
+            pending.setdefault(_canon(p["agent_label"]), []).append(i)
+    if not pending:
+        return chem_ids
+
+    labels = list(pending)
+    vecs = dict(vecs or {})
+    missing = [l for l in labels if l not in vecs]
+    if missing:
+        vecs.update(get_embeddings_batch(missing))
+    cur.execute(_SQL_NEAREST_ALIASES, ([Vector(vecs[l]) for l in labels],))
+    for row in cur.fetchall():
+        if row["dist"] < SIMILARITY_THRESHOLD:
+            for i in pending[labels[row["idx"] - 1]]:
+                chem_ids[i] = row["chemical_id"]
+
+    return chem_ids
+
 
-    # 2. semantic alias match
-    vec = get_embedding(_canon(label))
-    cur.execute(_EMBED_SQL, (vec,))
-    row = cur.fetchone()
-    if row and row["dist"] < SIMILARITY_THRESHOLD:
-        return row["chemical_id"]
+# ----------------------------------------------------------------------
+# batched writes
+# ----------------------------------------------------------------------
+# The no-op DO UPDATE lets RETURNING report existing headers as well,
+# so no follow-up SELECT is needed.  `pairs` must be duplicate-free.
+_SQL_UPSERT_HEADERS = """
+INSERT INTO chemical_properties (chemical_id, prop_type)
+SELECT * FROM unnest(%s::uuid[], %s::property_type[])
+ON CONFLICT (chemical_id, prop_type) DO UPDATE
+  SET prop_type = EXCLUDED.prop_type
+RETURNING id, chemical_id, prop_type::text AS prop_type;
+"""
 
-    return None
+def _property_ids(cur, pairs: List[Tuple[UUID, str]]) -> Dict[Tuple[UUID, str], UUID]:
+    """Ensure every (chemical_id, prop_type) header exists; return pair -> header id."""
+    cur.execute(_SQL_UPSERT_HEADERS, ([c for c, _ in pairs], [t for _, t in pairs]))
+    return {(row["chemical_id"], row["prop_type"]): row["id"] for row in cur.fetchall()}
+
+def _value_row(prop_id: UUID, p: Dict[str, Any]) -> tuple:
+    """One chemical_property_values row in PROPERTY_VALUE_COLUMNS order (id generated here)."""
+    return (uuid4(), prop_id, *_value_columns(p["value"]), p.get("unit"))
+
+
+def _group_duplicates(props: List[Dict[str, Any]]) -> List[Tuple[Dict[str, Any], List[str]]]:
+    """Collapse facts repeated across quotes: one (representative, quotes) per distinct fact."""
+    groups: Dict[tuple, Tuple[Dict[str, Any], List[str]]] = {}
+    for p in props:
+        key = (
+            p.get("agent_id"),
+            _canon(p["agent_label"]),
+            p["prop_type"],
+            orjson.dumps(p["value"], option=orjson.OPT_SORT_KEYS),
+            p.get("unit"),
+        )
+        groups.setdefault(key, (p, []))[1].append(p["quote"])
+    return list(groups.values())
 
 
 # ----------------------------------------------------------------------
@@ -85,70 +169,64 @@ def _resolve_chemical_id(cur, inchikey: str | None, label: str) -> UUID | None:
 def insert_agent_properties(
     paper_id: str,
     props: List[Dict[str, Any]],
+    cur=None,
+    vecs: Dict[str, Any] | None = None,
 ) -> None:
     """
     Insert each AgentProperty into
       chemical_properties → chemical_property_values → cpa_references
+    Repeats of the same fact share one value row with a reference per quote.
     If the chemical cannot be resolved, the property is skipped.
+    With a dict_row *cur* the rows join the caller's transaction; *vecs*
+    (label -> embedding, see property_labels) keeps the embedding call out of it.
     """
     if not props:
         return
 
     skipped = 0
-    with cursor_ctx(commit=True) as cur:
-        print(f'[TRACE] insert_agent_properties:')
-        for p in props:
-            print(f'\t{p}')
-            chem_id = _resolve_chemical_id(cur, p.get("agent_id"), p["agent_label"])
+    with shared_cursor_ctx(cur) as cur:
+        debug = log.isEnabledFor(logging.DEBUG)
+        log.debug("inserting %d agent properties", len(props))
+        groups = _group_duplicates(props)
+        chem_ids = _resolve_chemical_ids(cur, [p for p, _ in groups], vecs)
+
+        resolved: List[Tuple[UUID, Dict[str, Any], List[str]]] = []
+        for (p, quotes), chem_id in zip(groups, chem_ids):
+            if debug:
+                log.debug("\t%s (x%d)", p, len(quotes))
             if chem_id is None:
-                skipped += 1
+                skipped += len(quotes)
                 continue   # cannot attach property
-
-            # 1. ensure header row exists
-            cur.execute(
-                """
-                INSERT INTO chemical_properties (chemical_id, prop_type)
-                VALUES (%s, %s::property_type)
-                ON CONFLICT (chemical_id, prop_type) DO NOTHING
-                RETURNING id;
-                """,
-                (chem_id, p["prop_type"]),
-            )
-            row = cur.fetchone()
-            if row:
-                prop_id = row["id"]
-            else:
-                cur.execute(
-                    "SELECT id FROM chemical_properties "
-                    "WHERE chemical_id = %s AND prop_type = %s::property_type",
-                    (chem_id, p["prop_type"]),
-                )
-                prop_id = cur.fetchone()["id"]
-
-            # 2. value row
-            kind, colmap = _value_kind_and_columns(p["value"])
-            columns = ["property_id", "value_kind", *colmap.keys(), "unit"]
-            values  = [prop_id, kind, *colmap.values(), p.get("unit")]
-
-            cols_sql = ", ".join(columns)
-            ph_sql   = ", ".join(["%s"] * len(values))
-
-            cur.execute(
-                f"INSERT INTO chemical_property_values ({cols_sql}) "
-                f"VALUES ({ph_sql}) RETURNING id;",
-                tuple(values),
-            )
-            val_id = cur.fetchone()["id"]
-
-            # 3. provenance
-            cur.execute(
-                """
-                INSERT INTO cpa_references (property_value_id, paper_id, quote)
-                VALUES (%s, %s, %s);
-                """,
-                (val_id, paper_id, p["quote"]),
+            resolved.append((chem_id, p, quotes))
+
+        if resolved:
+            # 1. ensure header rows exist (one upsert, ids via RETURNING)
+            # sorted: a fixed lock order against concurrent papers' upserts
+            pairs = sorted(
+                dict.fromkeys((chem_id, p["prop_type"]) for chem_id, p, _ in resolved),
+                key=lambda pair: (str(pair[0]), pair[1]),
             )
+            prop_ids = _property_ids(cur, pairs)
+
+            # 2. all value rows in one COPY (ids generated client-side)
+            value_rows = [
+                _value_row(prop_ids[(chem_id, p["prop_type"])], p)
+                for chem_id, p, _ in resolved
+            ]
+            with cur.copy(
+                f"COPY chemical_property_values ({', '.join(PROPERTY_VALUE_COLUMNS)}) FROM STDIN"
+            ) as copy:
+                for row in value_rows:
+                    copy.write_row(row)
+
+            # 3. provenance, also one COPY
+            with cur.copy(
+                "COPY cpa_references (property_value_id, paper_id, quote) FROM STDIN"
+            ) as copy:
+                for row, (_, _, quotes) in zip(value_rows, resolved):
+                    for quote in quotes:
+                        copy.write_row((row[0], paper_id, quote))
 
     if skipped:
         print(f"[WARN] insert_agent_properties: {skipped} properties skipped "
-              f"(chemical not found via InChIKey or embedding)")
\ No newline at end of file
+              f"(chemical not found via InChIKey or embedding)")
@@ -3,35 +3,77 @@ Utility that ingests the JSON produced by the LLM pipeline
 into the 4‑table normalised store.
 """
 from __future__ import annotations
-import re
-import json, hashlib
-from typing import Dict, Any
-from datetime import datetime
+import hashlib
+import logging
+from typing import Dict
 
 import psycopg
 from psycopg.rows import dict_row
+from pgvector import Vector
+from pydantic import TypeAdapter
 
 from distiller.schemas.cpa_chemical import (
-    CPAChemical, ChemicalPropertyValue)
-from distiller.schemas.structured_output import CPAPaperData
+    CPAChemical, ChemicalPropertyValue, PROPERTY_VALUE_COLUMNS)
+from distiller.schemas.structured_output import AgentProperty
 from distiller.postgres_connection import connection_ctx
-from pipelines.utils.embeddings import get_embedding
+from pipelines.utils.embeddings import get_embeddings_batch
 SIMILARITY_THRESHOLD = 0.38
-_INCHI_PAT = re.compile(r"^[A-Z]{14}-[A-Z]{10}-[A-Z]$", re.I)
+log = logging.getLogger(__name__)
+# Built once; validates the whole agent_properties array in a single core call.
+_AGENT_PROPERTIES = TypeAdapter(list[AgentProperty])
 
 def _is_valid_inchikey(k: str | None) -> bool:
-    return bool(k and _INCHI_PAT.match(k))
+    """14-10-1 blocks of ASCII letters (either case), checked without the regex engine."""
+    return bool(
+        k
+        and len(k) == 27
+        and k[14] == "-"
+        and k[25] == "-"
+        and k.count("-") == 2
+        and k.isascii()
+        and k.replace("-", "").isalpha()
+    )
 
 def _canon(text: str) -> str:
     """Return the canonical form used for dedup + embedding."""
     return text.strip().lower()
 
-def _upsert_aliases(cur, chem_id: str, preferred: str, syns: list[str]) -> None:
+# Statements run once per property / alias; executed with prepare=True so
+# pooled connections parse and plan them once and reuse the plan.
+_SQL_INSERT_ALIAS = """
+INSERT INTO cpa_chemical_aliases
+  (chemical_id, alias, embedding, is_preferred)
+VALUES (%s, %s, %s, %s)
+ON CONFLICT DO NOTHING;
+"""
+
+_SQL_CHEM_BY_INCHIKEY = "SELECT id FROM cpa_chemicals WHERE inchikey = %s;"
+
+_SQL_NEAREST_ALIAS = """
+SELECT chemical_id, alias, embedding <-> %(v)s::vector AS dist
+FROM   cpa_chemical_aliases
+ORDER  BY embedding::halfvec(3072) <-> %(v)s::vector::halfvec(3072)
+LIMIT  1;
+"""
+
+# All (chemical_id, prop_type) headers of a paper in one statement; the no-op
+# DO UPDATE makes RETURNING report existing rows too.  Input must be duplicate-free.
+_SQL_UPSERT_PROPERTIES = """
+INSERT INTO chemical_properties (chemical_id, prop_type)
+SELECT * FROM unnest(%s::uuid[], %s::property_type[])
+ON CONFLICT (chemical_id, prop_type) DO UPDATE
+  SET prop_type = EXCLUDED.prop_type
+RETURNING id, chemical_id, prop_type::text AS prop_type;
+"""
+
+def _upsert_aliases(
+    cur, chem_id: str, preferred: str, syns: list[str], vecs: Dict[str, list[float]]
+) -> None:
     """
     • Insert the preferred name (is_preferred = True)
     • Insert each synonym once (is_preferred = False)
     • Skip duplicates within the same call
-    • Use the canonical text to compute the embedding
+    • Look the embedding up in `vecs` by canonical text
     """
     seen: set[str] = set()
 
@@ -48,37 +90,40 @@ def _upsert_aliases(cur, chem_id: str, preferred: str, syns: list[str]) -> None:
             continue
         seen.add(canonical_name)
 
-        vec = get_embedding(canonical_name)
+        vec = Vector(vecs[canonical_name])
         cur.execute(
-            """
-            INSERT INTO cpa_chemical_aliases
-              (chemical_id, alias, embedding, is_preferred)
-            VALUES (%s, %s, %s, %s)
-            ON CONFLICT DO NOTHING;
-            """,
-            (chem_id, name, vec, is_preferred),
+            _SQL_INSERT_ALIAS, (chem_id, name, vec, is_preferred), prepare=True
         )
 
-def _upsert_chemical(cur, chem: CPAChemical, paper_id: str | None = None) -> str:
-    """Safe upsert: semantic → attach valid, unique InChIKey → fallback."""
+def _upsert_chemical(
+    cur,
+    chem: CPAChemical,
+    vecs: Dict[str, list[float]],
+    unverified: list[tuple],
+    paper_id: str | None = None,
+) -> str:
+    """
+    Safe upsert: known InChIKey → semantic → attach valid, unique InChIKey → fallback.
+    Rejected keys are appended to *unverified* for the caller to write in one batch.
+    """
+    # ── 0.  exact InChIKey hit (unique index) skips the ANN probe ───
+    if _is_valid_inchikey(chem.inchikey):
+        cur.execute(_SQL_CHEM_BY_INCHIKEY, (chem.inchikey,), prepare=True)
+        hit = cur.fetchone()
+        if hit:
+            _upsert_aliases(cur, hit["id"], chem.preferred_name, chem.synonyms, vecs)
+            return hit["id"]
+
     canon_name = _canon(chem.preferred_name)
-    q_vec      = get_embedding(canon_name)
+    q_vec      = Vector(vecs[canon_name])
 
     # ── 1.  semantic match in alias table  ──────────────────────────
-    cur.execute(
-        """
-        SELECT chemical_id, alias, embedding <-> %s::vector AS dist
-        FROM   cpa_chemical_aliases
-        ORDER  BY dist
-        LIMIT  1;
-        """,
-        (q_vec,),
-    )
+    cur.execute(_SQL_NEAREST_ALIAS, {"v": q_vec}, prepare=True)
     row = cur.fetchone()
     if row and row["dist"] < SIMILARITY_THRESHOLD:
         chem_id = row["chemical_id"]
 
-        _upsert_aliases(cur, chem_id, chem.preferred_name, chem.synonyms)
+        _upsert_aliases(cur, chem_id, chem.preferred_name, chem.synonyms, vecs)
         return chem_id
 
     # ── 2.  No semantic hit → try InChIKey upsert if key looks OK ───
@@ -95,11 +140,13 @@ def _upsert_chemical(cur, chem: CPAChemical, paper_id: str | None = None) -> str
             (chem.inchikey, chem.preferred_name, q_vec),
         )
         chem_id = cur.fetchone()["id"]
-        _upsert_aliases(cur, chem_id, chem.preferred_name, chem.synonyms)
+        _upsert_aliases(cur, chem_id, chem.preferred_name, chem.synonyms, vecs)
         return chem_id
 
     # ── 3.  Last resort: new row without inchikey + log suspect key ─
-    print(f"[TRACE] Inserting chemical: '{chem.preferred_name}' (no InChIKey) distance: {row['dist']} compared with: '{row['alias']}')")
+    if row is not None:
+        log.debug("new chemical %r without InChIKey; nearest alias %r at %.3f",
+                  chem.preferred_name, row["alias"], row["dist"])
     cur.execute(
         """
         INSERT INTO cpa_chemicals (preferred_name, embedding)
@@ -111,87 +158,41 @@ def _upsert_chemical(cur, chem: CPAChemical, paper_id: str | None = None) -> str
         (chem.preferred_name, q_vec),
     )
     chem_id = cur.fetchone()["id"]
-    _upsert_aliases(cur, chem_id, chem.preferred_name, chem.synonyms)
+    _upsert_aliases(cur, chem_id, chem.preferred_name, chem.synonyms, vecs)
 
-    # Store the hallucinated or malformed key for later inspection
+    # Queue the hallucinated or malformed key for later inspection
     if chem.inchikey:
-        cur.execute(
-            "INSERT INTO cpa_unverified_inchikeys "
-            "(supplied_key, source_paper, note) VALUES (%s, %s, %s)",
-            (
-                chem.inchikey,
-                paper_id,
-                "Failed validation or duplicate; not stored in chemicals table.",
-            ),
-        )
+        unverified.append((
+            chem.inchikey,
+            paper_id,
+            "Failed validation or duplicate; not stored in chemicals table.",
+        ))
     return chem_id
-def _get_property_id(cur, chemical_id: str, ptype: PropertyType) -> str:
-    """
-    Ensure (chemical_id, prop_type) exists in `chemical_properties`
-    and return its UUID.
 
-    • INSERT if missing.
-    • Otherwise fetch the existing row.
+def _get_property_ids(cur, pairs: list[tuple]) -> Dict[tuple, str]:
     """
-    cur.execute(
-        """
-        INSERT INTO chemical_properties (chemical_id, prop_type)
-        VALUES (%s, %s)
-        ON CONFLICT (chemical_id, prop_type) DO NOTHING
-        RETURNING id;
-        """,
-        (chemical_id, ptype.value),
-    )
-    row = cur.fetchone()
-    if row:                      # inserted just now
-        return row["id"]
+    Ensure every (chemical_id, prop_type) exists in `chemical_properties`
+    and return {(chemical_id, prop_type value): id}.
+    """
+    pairs = list(dict.fromkeys(pairs))
+    cur.execute(_SQL_UPSERT_PROPERTIES, ([c for c, _ in pairs], [t for _, t in pairs]))
+    return {(r["chemical_id"], r["prop_type"]): r["id"] for r in cur.fetchall()}
 
-    # already existed → fetch
-    cur.execute(
-        "SELECT id FROM chemical_properties WHERE chemical_id = %s AND prop_type = %s",
-        (chemical_id, ptype.value),
-    )
-    return cur.fetchone()["id"]
+def _copy_property_values(cur, rows: list[tuple]) -> None:
+    """Stream all value rows of a paper in one COPY instead of one INSERT each."""
+    with cur.copy(
+        f"COPY chemical_property_values ({', '.join(PROPERTY_VALUE_COLUMNS)}) FROM STDIN"
+    ) as copy:
+        for row in rows:
+            copy.write_row(row)
 
-def _get_property_value_id(
-    cur, prop_id: str, cpv: ChemicalPropertyValue
-) -> str:
-    try:
-        cur.execute(
-            """
-            INSERT INTO chemical_property_values
-              (property_id, value_kind, numeric_value, range_min, range_max,
-               raw_value, extra, unit)
-        VALUES
-          (%(property_id)s,%(value_kind)s,%(numeric_value)s,%(range_min)s,
-           %(range_max)s,%(raw_value)s,%(extra)s,%(unit)s)
-        RETURNING id;
-        """,
-        {
-            "property_id": prop_id,
-            "value_kind": cpv.value_kind.value,
-            "numeric_value": cpv.numeric_value,
-            "range_min": cpv.range_min,
-            "range_max": cpv.range_max,
-            "raw_value": cpv.raw_value,
-            "extra": json.dumps(cpv.extra) if cpv.extra is not None else None,
-            "unit": cpv.unit,
-        },
-        )   
-        row = cur.fetchone()
-        if row:
-            return row["id"]
-        cur.execute(
-            """
-            SELECT id FROM chemical_property_values
-            WHERE property_id = %s
-            """,
-            (prop_id,),
-        )
-        return cur.fetchone()["id"]
-    except Exception as e:
-        print(f"[WARN] Failed to insert property value: {e}")
-        return None
+def _copy_references(cur, rows: list[tuple]) -> None:
+    """Stream (property_value_id, paper_id, quote, link) rows in one COPY."""
+    with cur.copy(
+        "COPY cpa_references (property_value_id, paper_id, quote, link) FROM STDIN"
+    ) as copy:
+        for row in rows:
+            copy.write_row(row)
 
 
 def store_cpa_data(md5_hash: str) -> None:
@@ -200,58 +201,77 @@ def store_cpa_data(md5_hash: str) -> None:
     objects into the normalised CPA tables.
     """
     print(f'[TRACE] store_cpa_data: {md5_hash}')
+    # 1. pull only the parts of the JSON used here; experiments and
+    #    formulations stay in Postgres instead of being decoded and validated
     with connection_ctx() as conn, conn.cursor(row_factory=dict_row) as cur:
-        # 1. pull JSON
         cur.execute(
-            "SELECT cpa_facts_json, doi FROM papers WHERE md5_hash = %s", (md5_hash,)
+            """
+            SELECT doi,
+                   cpa_facts_json->>'paper_id'        AS paper_id,
+                   cpa_facts_json->'agent_properties' AS agent_properties
+            FROM   papers
+            WHERE  md5_hash = %s
+            """,
+            (md5_hash,),
         )
         row = cur.fetchone()
-        if not row or not row["cpa_facts_json"]:
-            raise RuntimeError(f"No CPA facts stored for md5={md5_hash}")
-
-        paper_json: Dict[str, Any] = row["cpa_facts_json"]
-        paper = CPAPaperData.model_validate(paper_json)
-        now = datetime.now()
-        # 2. loop over agent properties
-        for ap in paper.agent_properties:
-            # 2.1 ensure chemical row exists
-            chem = CPAChemical(
-                inchikey=ap.agent_id,
-                preferred_name=ap.agent_label,
-                synonyms=[],
-            )
-            chemical_id = _upsert_chemical(cur, chem, row["doi"])
+    if not row or row["paper_id"] is None:
+        raise RuntimeError(f"No CPA facts stored for md5={md5_hash}")
 
-            # 2.2 ensure (chemical, prop_type) row exists
-            prop_id = _get_property_id(cur, chemical_id, ap.prop_type)
+    # repeats of the same fact share one value row, with a reference per quote
+    grouped: Dict[tuple, tuple[AgentProperty, list[str]]] = {}
+    for ap in _AGENT_PROPERTIES.validate_python(row["agent_properties"] or []):
+        key = (ap.agent_id, _canon(ap.agent_label), ap.prop_type,
+               ap.model_dump_json(include={"value"}), ap.unit)
+        grouped.setdefault(key, (ap, []))[1].append(ap.quote)
+    props = [ap for ap, _ in grouped.values()]
+    quotes = [qs for _, qs in grouped.values()]
+    paper_id = row['doi'] if row['doi'] else row['paper_id']
+    chems = [
+        CPAChemical(inchikey=ap.agent_id, preferred_name=ap.agent_label, synonyms=[])
+        for ap in props
+    ]
 
-            # 2.3 build value row
-            cpv = ChemicalPropertyValue.from_fact_value(
-                property_id=prop_id,
-                value=ap.value,
-                unit=ap.unit,
-                created_at=now,
-            )
-            prop_val_id = _get_property_value_id(cur, prop_id, cpv)
-
-            if row['doi']:
-                paper_id = row['doi']
-            else:
-                paper_id = paper.paper_id
-            # 2.4 always add reference (duplicates are negligible)
-            cur.execute(
-                """
-                INSERT INTO cpa_references
-                    (property_value_id, paper_id, quote, link)
-                VALUES (%s, %s, %s, %s)
-                ON CONFLICT DO NOTHING    -- idempotent if you later add UNIQUE
-                """,
-                (
-                    prop_val_id,
-                    paper_id,
-                    ap.quote,
-                    str(paper_id) if paper_id is not None else None,
-                ),
+    # 2. every embedding up front, without holding a connection
+    vecs = get_embeddings_batch(
+        [_canon(name) for chem in chems for name in (chem.preferred_name, *chem.synonyms)]
+    )
+
+    with connection_ctx() as conn, conn.cursor(row_factory=dict_row) as cur:
+        unverified: list[tuple] = []   # (supplied_key, source_paper, note)
+        # 3. ensure every chemical row exists (sequential: later chemicals
+        #    may match aliases inserted for earlier ones)
+        keys = [
+            (_upsert_chemical(cur, chem, vecs, unverified, row["doi"]), ap.prop_type.value)
+            for ap, chem in zip(props, chems)
+        ]
+
+        # 3.1 all (chemical, prop_type) headers in one upsert
+        prop_ids = _get_property_ids(cur, keys)
+
+        # 3.2 queue value rows
+        values: list[tuple] = [   # (property_id, value, unit)
+            (prop_ids[key], ap.value, ap.unit) for key, ap in zip(keys, props)
+        ]
+
+        # 4. all value rows in one COPY (ids generated client-side)
+        value_rows = ChemicalPropertyValue.to_row_tuples(values)
+        _copy_property_values(cur, value_rows)
+
+        # 5. always add reference; value ids are fresh, so COPY cannot collide
+        link = str(paper_id) if paper_id is not None else None
+        _copy_references(cur, [
+            (value_row[0], paper_id, quote, link)
+            for value_row, qs in zip(value_rows, quotes)
+            for quote in qs
+        ])
+
+        # 6. rejected InChIKeys, one batch off the per-chemical path
+        if unverified:
+            cur.executemany(
+                "INSERT INTO cpa_unverified_inchikeys "
+                "(supplied_key, source_paper, note) VALUES (%s, %s, %s)",
+                unverified,
             )
 
         conn.commit()
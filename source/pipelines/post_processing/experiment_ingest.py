@@ -1,7 +1,7 @@
 # pipelines/post_processing/experiment_ingest.py
 from __future__ import annotations
 from typing import List, Dict, Any
-from distiller.postgres_connection import cursor_ctx
+from distiller.postgres_connection import shared_cursor_ctx
 from psycopg.types.json import Json
 
 def _paper_uuid_from_md5(cur, md5_hash: str) -> str | None:
@@ -10,11 +10,12 @@ def _paper_uuid_from_md5(cur, md5_hash: str) -> str | None:
     return row["id"] if row else None
 
 
-def insert_experiments(paper_md5: str, experiments: List[Dict[str, Any]]) -> None:
+def insert_experiments(paper_md5: str, experiments: List[Dict[str, Any]], cur=None) -> None:
+    """Insert the experiments pass; with *cur* the rows join the caller's transaction."""
     if not experiments:
         return
 
-    with cursor_ctx(commit=True) as cur:
+    with shared_cursor_ctx(cur) as cur:
         paper_uuid = _paper_uuid_from_md5(cur, paper_md5)
         if paper_uuid is None:
             raise RuntimeError(f"No `papers` row for md5={paper_md5}")
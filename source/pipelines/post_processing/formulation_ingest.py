@@ -1,16 +1,17 @@
 # pipelines/post_processing/formulation_ingest.py
 from __future__ import annotations
 
-import json
 import re
 from typing import List, Dict, Any, Tuple
 from uuid import UUID
-from pipelines.utils.pipeline_utils import resolve_alias_id
+from pgvector import Vector
+from pipelines.utils.pipeline_utils import bulk_resolve, nearest_alias_id
 
 from distiller.postgres_connection import cursor_ctx
 from psycopg.types.json import Json
 from pipelines.utils.embeddings import (
     get_embedding,
+    get_embeddings_batch,
     SIMILARITY_THRESHOLD,
 )
 def insert_placeholder_chemical(
@@ -28,12 +29,13 @@ def insert_placeholder_chemical(
       and make <label> its preferred alias.
     """
     canon = label.strip().lower()
-    emb   = get_embedding(canon)
+    emb   = Vector(get_embedding(canon))   # binary vector on the wire, not a float8[]
 
     # 0️⃣  Does the alias already exist globally?
     cur.execute(
         "SELECT id, chemical_id FROM cpa_chemical_aliases WHERE alias = %s;",
         (label,),
+        prepare=True,
     )
     row = cur.fetchone()
     if row:
@@ -48,6 +50,7 @@ def insert_placeholder_chemical(
         RETURNING id;
         """,
         (label, role, emb),
+        prepare=True,
     )
     chemical_id: UUID = cur.fetchone()["id"]
 
@@ -60,6 +63,7 @@ def insert_placeholder_chemical(
         RETURNING id;
         """,
         (chemical_id, label, emb),
+        prepare=True,
     )
     alias_id: UUID = cur.fetchone()["id"]
 
@@ -80,6 +84,7 @@ def _experiment_uuid_from_map_or_db(
         "SELECT id FROM experiments "
         "WHERE paper_id = %s AND local_id = %s;",
         (paper_uuid, local_id),
+        prepare=True,
     )
     row = cur.fetchone()
     return row["id"] if row else None
@@ -102,6 +107,21 @@ def _amount_as_columns(
 
 # ─────────────────────────── ingest API ────────────────────────────
 
+# Property header + value row in one round-trip. The no-op DO UPDATE (rather
+# than DO NOTHING) keeps RETURNING populated when the header already exists.
+_SQL_INSERT_FORMULATION_PROPERTY = """
+WITH p AS (
+    INSERT INTO formulation_properties (experiment_id, component_id, prop_type)
+    VALUES (%s, %s, 'LOADING_TEMPERATURE')
+    ON CONFLICT (experiment_id, prop_type, formulation_id, component_id)
+    DO UPDATE SET prop_type = EXCLUDED.prop_type
+    RETURNING id
+)
+INSERT INTO formulation_property_values
+       (property_id, value_kind, range_min, range_max, extra, unit)
+VALUES ((SELECT id FROM p), %s, %s, %s, %s, %s);
+"""
+
 def insert_formulations(
     paper_md5: str,
     formulations: List[Dict[str, Any]],
@@ -110,134 +130,140 @@ def insert_formulations(
     if not formulations:
         return
 
+    # Warm the embedding cache with every component label in one request,
+    # before a connection is taken; alias resolution and
+    # insert_placeholder_chemical then hit the cache.
+    get_embeddings_batch(
+        [c["label"].strip().lower() for f in formulations for c in f["components"]]
+    )
+
     with cursor_ctx(commit=True) as cur:
         paper_uuid = _paper_uuid_from_md5(cur, paper_md5)
         if paper_uuid is None:
             raise RuntimeError(f"No `papers` row for md5={paper_md5}")
 
-        for f in formulations:
-            experiment_id = _experiment_uuid_from_map_or_db(
-                cur, paper_uuid, f["experiment_id"], experiments
-            )
-            if experiment_id is None:
-                print(
-                    f"[WARN] formulation skipped – "
-                    f"experiment {f['experiment_id']} not found for paper {paper_md5}"
-                )
-                continue
-
-            # 1️⃣  formulation header
-            cur.execute(
-                """
-                INSERT INTO formulations (experiment_id, label, quote)
-                VALUES (%s, %s, %s)
-                ON CONFLICT (experiment_id, label) DO UPDATE
-                      SET quote = EXCLUDED.quote
-                RETURNING id;
-                """,
-                (experiment_id, f["label"], f["quote"]),
-            )
-            formulation_id = cur.fetchone()["id"]
-
-            # 2️⃣  components
-            comp_rows: list[Tuple] = []
-            prop_to_create: list[Tuple] = []   # (comp_dict, aux_tuple)
-
-            for comp in f["components"]:
-                # alias / chemical resolution for CPA + ADJUVANT
-                alias_id, chem_id = (None, None)
-                if comp["role"] in ("CPA", "ADJUVANT"):
-                    alias_id, chem_id = resolve_alias_id(
-                        cur,
-                        inchikey = comp.get("agent_id"),
-                        label    = comp["label"],
-                    )
-                if chem_id is None:
-                    alias_id, chem_id = insert_placeholder_chemical(
-                        cur,
-                        label = comp["label"],
-                        role  = comp["role"],
-                    )
-
-                num_val, rng_min, rng_max, vkind = _amount_as_columns(comp.get("amount"))
+        # (role, agent_id, label) -> (alias_id, chemical_id), scoped to this
+        # transaction so rows created here are never served after a rollback
+        resolved_ids: dict[tuple, tuple[UUID | None, UUID | None]] = {}
+        # every InChIKey-identified CPA/ADJUVANT of the paper in one query
+        by_inchikey = bulk_resolve(
+            cur,
+            [
+                (c.get("agent_id"), c["label"])
+                for f in formulations
+                for c in f["components"]
+                if c["role"] in ("CPA", "ADJUVANT")
+            ],
+        )
 
-                comp_rows.append(
-                    (
-                        formulation_id,
-                        comp["role"],
-                        chem_id,   # may be NULL
-                        alias_id,  # may be NULL
-                        num_val,
-                        comp.get("unit"),
-                        comp["quote"],
-                        comp.get("note"),
-                    )
-                )
-
-                if vkind in ("RANGE", "STRUCT"):
-                    prop_to_create.append((comp, (rng_min, rng_max, vkind, alias_id)))
-
-            if comp_rows:
-                cur.executemany(
-                    """
-                    INSERT INTO formulation_components
-                           (formulation_id, role, chemical_id, alias_id,
-                            amount, unit, quote, note)
-                    VALUES (%s,%s,%s,%s,%s,%s,%s,%s)
-                    ON CONFLICT DO NOTHING;
-                    """,
-                    comp_rows,
+        # Pipeline mode: statements whose results are not read right away
+        # (component/value inserts) share round-trips with the next fetch.
+        with cur.connection.pipeline():
+            for f in formulations:
+                experiment_id = _experiment_uuid_from_map_or_db(
+                    cur, paper_uuid, f["experiment_id"], experiments
                 )
+                if experiment_id is None:
+                    print(
+                        f"[WARN] formulation skipped – "
+                        f"experiment {f['experiment_id']} not found for paper {paper_md5}"
+                    )
+                    continue
 
-            # map alias_id → component_id
-            cur.execute(
-                """
-                SELECT id, alias_id
-                  FROM formulation_components
-                 WHERE formulation_id = %s;
-                """,
-                (formulation_id,),
-            )
-            alias_to_compid = {r["alias_id"]: r["id"] for r in cur.fetchall()}
-
-            # 3️⃣  dependent props for RANGE / STRUCT
-            for comp_dict, (rmin, rmax, vkind, alias_id) in prop_to_create:
-                comp_id = alias_to_compid.get(alias_id)
-                if comp_id is None:
-                    continue   # defensive; should not happen
-
-                # 3.a header
+                # 1️⃣  formulation header
                 cur.execute(
                     """
-                    INSERT INTO formulation_properties
-                           (experiment_id, component_id, prop_type)
-                    VALUES (%s, %s, 'LOADING_TEMPERATURE')
-                    ON CONFLICT (experiment_id, prop_type,
-                                 formulation_id, component_id)
-                    DO NOTHING
+                    INSERT INTO formulations (experiment_id, label, quote)
+                    VALUES (%s, %s, %s)
+                    ON CONFLICT (experiment_id, label) DO UPDATE
+                          SET quote = EXCLUDED.quote
                     RETURNING id;
                     """,
-                    (experiment_id, comp_id),
+                    (experiment_id, f["label"], f["quote"]),
+                    prepare=True,
                 )
-                prop_id = cur.fetchone()["id"]
+                formulation_id = cur.fetchone()["id"]
 
-                # 3.b value row
-                cur.execute(
-                    """
-                    INSERT INTO formulation_property_values
-                           (property_id, value_kind,
-                            range_min, range_max, extra, unit)
-                    VALUES (%s,%s,%s,%s,%s,%s);
-                    """,
+                # 2️⃣  components
+                comp_rows: list[Tuple] = []
+                prop_to_create: list[Tuple] = []   # (comp_dict, aux_tuple)
+
+                for comp in f["components"]:
+                    key = (comp["role"], comp.get("agent_id"), comp["label"])
+                    if key in resolved_ids:
+                        alias_id, chem_id = resolved_ids[key]
+                    else:
+                        # alias / chemical resolution for CPA + ADJUVANT
+                        alias_id, chem_id = (None, None)
+                        if comp["role"] in ("CPA", "ADJUVANT"):
+                            hit = by_inchikey.get((comp.get("agent_id"), comp["label"]))
+                            if hit is not None:
+                                alias_id, chem_id = hit
+                            else:
+                                alias_id, chem_id = nearest_alias_id(cur, label=comp["label"])
+                        if chem_id is None:
+                            alias_id, chem_id = insert_placeholder_chemical(
+                                cur,
+                                label = comp["label"],
+                                role  = comp["role"],
+                            )
+                        resolved_ids[key] = (alias_id, chem_id)
+
+                    num_val, rng_min, rng_max, vkind = _amount_as_columns(comp.get("amount"))
+
+                    comp_rows.append(
+                        (
+                            formulation_id,
+                            comp["role"],
+                            chem_id,   # may be NULL
+                            alias_id,  # may be NULL
+                            num_val,
+                            comp.get("unit"),
+                            comp["quote"],
+                            comp.get("note"),
+                        )
+                    )
+
+                    if vkind in ("RANGE", "STRUCT"):
+                        prop_to_create.append((comp, (rng_min, rng_max, vkind, alias_id)))
+
+                # map alias_id → component_id straight from the insert
+                alias_to_compid: dict = {}
+                if comp_rows:
+                    cur.executemany(
+                        """
+                        INSERT INTO formulation_components
+                               (formulation_id, role, chemical_id, alias_id,
+                                amount, unit, quote, note)
+                        VALUES (%s,%s,%s,%s,%s,%s,%s,%s)
+                        ON CONFLICT DO NOTHING
+                        RETURNING id, alias_id;
+                        """,
+                        comp_rows,
+                        returning=True,
+                    )
+                    for _ in cur.results():
+                        r = cur.fetchone()
+                        if r:
+                            alias_to_compid[r["alias_id"]] = r["id"]
+
+                # 3️⃣  dependent props for RANGE / STRUCT – header + value
+                #     in one statement per component, one executemany
+                prop_rows = [
                     (
-                        prop_id,
+                        experiment_id,
+                        alias_to_compid[alias_id],
                         vkind,
                         rmin,
                         rmax,
                         Json(comp_dict["amount"]) if vkind == "STRUCT" else None,
                         comp_dict.get("unit"),
-                    ),
-                )
+                    )
+                    for comp_dict, (rmin, rmax, vkind, alias_id) in prop_to_create
+                    if alias_id in alias_to_compid   # defensive; should not happen
+                ]
+                if prop_rows:
+                    cur.executemany(_SQL_INSERT_FORMULATION_PROPERTY, prop_rows)
 
 # NOTE: make sure you ran the schema patch:
 #   ALTER TABLE formulation_components
@@ -1,16 +1,112 @@
-
 from __future__ import annotations
-import functools, os, openai
-from typing import List
+import hashlib, os, openai, threading
+from array import array
+from collections import OrderedDict
+from typing import Dict, List
+
+from pgvector import Vector
+
+from distiller.postgres_connection import cursor_ctx
 
 openai.api_key = os.getenv("OPENAI_API_KEY")
 
-@functools.lru_cache(maxsize=4096)
+_MODEL = "text-embedding-3-large"
+# Opt-in second level behind the in-process LRU: the `embedding_cache` table
+# survives restarts, so re-ingesting a corpus does not re-embed its names.
+_DB_CACHE = os.getenv("EMBEDDING_DB_CACHE", "0") == "1"
+
+# Shared LRU for get_embedding and get_embeddings_batch; keys are the
+# already-canonicalised strings the callers pass in. Vectors are held as
+# packed float32 (what pgvector stores anyway): 12 KB per 3072-d entry
+# instead of ~100 KB as a list of Python floats.
+_CACHE_SIZE = 8192
+_cache: "OrderedDict[str, array]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+def _cache_get(text: str) -> List[float] | None:
+    with _cache_lock:
+        vec = _cache.get(text)
+        if vec is None:
+            return None
+        _cache.move_to_end(text)
+    return vec.tolist()
+
+def _cache_put(text: str, vec: List[float]) -> None:
+    packed = array("f", vec)
+    with _cache_lock:
+        _cache[text] = packed
+        _cache.move_to_end(text)
+        if len(_cache) > _CACHE_SIZE:
+            _cache.popitem(last=False)
+
+def _db_key(text: str) -> bytes:
+    return hashlib.sha1(f"{_MODEL}\0{text}".encode()).digest()
+
+def _db_lookup(texts: List[str]) -> Dict[str, List[float]]:
+    """Vectors already in `embedding_cache` for *texts* (empty when the table is disabled)."""
+    if not _DB_CACHE or not texts:
+        return {}
+    keys = {_db_key(t): t for t in texts}
+    with cursor_ctx() as cur:
+        cur.execute(
+            "SELECT key, embedding FROM embedding_cache WHERE key = ANY(%s);",
+            (list(keys),),
+        )
+        return {keys[bytes(r["key"])]: r["embedding"].tolist() for r in cur.fetchall()}
+
+def _db_store(vecs: Dict[str, List[float]]) -> None:
+    if not _DB_CACHE or not vecs:
+        return
+    with cursor_ctx(commit=True) as cur:
+        cur.executemany(
+            "INSERT INTO embedding_cache (key, model, embedding) VALUES (%s, %s, %s) "
+            "ON CONFLICT DO NOTHING;",
+            [(_db_key(t), _MODEL, Vector(v)) for t, v in vecs.items()],
+        )
+
 def get_embedding(text: str) -> List[float]:
-    rsp = openai.embeddings.create(
-        input=text,
-        model="text-embedding-3-large"
-    )
-    return rsp.data[0].embedding
+    vec = _cache_get(text)
+    if vec is not None:
+        return vec
+    vec = _db_lookup([text]).get(text)
+    if vec is None:
+        rsp = openai.embeddings.create(
+            input=text,
+            model=_MODEL
+        )
+        vec = rsp.data[0].embedding
+        _db_store({text: vec})
+    _cache_put(text, vec)
+    return vec
+
+_EMBED_BATCH = 512  # inputs per request, well under the API's 2048 cap
+
+def get_embeddings_batch(names: List[str]) -> Dict[str, List[float]]:
+    """Embed many strings with one request per _EMBED_BATCH inputs; returns name -> vector."""
+    out: Dict[str, List[float]] = {}
+    missing: List[str] = []
+    for name in dict.fromkeys(names):
+        vec = _cache_get(name)
+        if vec is not None:
+            out[name] = vec
+        else:
+            missing.append(name)
+    for name, vec in _db_lookup(missing).items():
+        out[name] = vec
+        _cache_put(name, vec)
+    missing = [name for name in missing if name not in out]
+    fetched: Dict[str, List[float]] = {}
+    for i in range(0, len(missing), _EMBED_BATCH):
+        chunk = missing[i:i + _EMBED_BATCH]
+        rsp = openai.embeddings.create(
+            input=chunk,
+            model=_MODEL
+        )
+        for item in rsp.data:
+            fetched[chunk[item.index]] = item.embedding
+            _cache_put(chunk[item.index], item.embedding)
+    _db_store(fetched)
+    out.update(fetched)
+    return out
 
 SIMILARITY_THRESHOLD = 0.38
\ No newline at end of file
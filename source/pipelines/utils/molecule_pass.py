@@ -1,11 +1,16 @@
 from .helpers import _llm_extract
 from distiller.schemas.agent import CPACoreData
+from distiller.utils.schema_utils import model_json_schema
 from jinja2 import Environment, FileSystemLoader
+from pathlib import Path
 
-_jinja = Environment(loader=FileSystemLoader("prompts"))
+# resolved from this file, so the template loads at import whatever the working directory
+_jinja = Environment(loader=FileSystemLoader(Path(__file__).resolve().parents[2] / "prompts"))
+
+# Built once: schema introspection and template lookup stay off the per-paper path.
+_AGENT_TEMPLATE = _jinja.get_template("agent_prompt.j2")
+_AGENT_SCHEMA = model_json_schema(CPACoreData)
 
 def extract_agents(paper_text: str) -> list[dict] | None:
-    prompt = _jinja.get_template("agent_prompt.j2").render(
-        PAPER_TEXT=paper_text, SCHEMA=CPACoreData.model_json_schema()
-    )
+    prompt = _AGENT_TEMPLATE.render(PAPER_TEXT=paper_text, SCHEMA=_AGENT_SCHEMA)
     return _llm_extract(prompt, CPACoreData)
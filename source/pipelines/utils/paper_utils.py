@@ -1,19 +1,23 @@
-import json
+import orjson
 import os
-from typing import Any, Dict, List
+from typing import Dict, List
 from openai import OpenAI
 from pydantic import ValidationError
 from distiller.schemas.papers import Paper
-from distiller.utils.file_utils import clean_json_response
+from distiller.utils.file_utils import clean_json_response, split_prompt_template
+from distiller.utils.s3_utils import GLOBAL_S3, read_s3_text
 from distiller.postgres_connection import cursor_ctx
+from distiller.utils.db_utils import get_cached_extraction, prompt_version, store_cached_extraction
+from distiller.utils.schema_utils import model_json_schema
 from collections.abc import Sequence
 from distiller.schemas.structured_output import CPAPaperData
+from psycopg import sql
 from psycopg.errors import NoDataFound 
-import boto3
 import logging
+from distiller.utils.concurrency import DEFAULT_MAX_WORKERS, run_bounded
 log = logging.getLogger(__name__)
 
-s3 = boto3.client("s3")
+s3 = GLOBAL_S3
 
 _OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 if not _OPENAI_API_KEY:
@@ -46,123 +50,138 @@ SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 SCHEMA_PATH = os.path.join(os.path.dirname(SCRIPT_DIR), "..", "schema.json")
 PROMPT_PATH = os.path.join(os.path.dirname(SCRIPT_DIR), "..", "gemini_prompt.txt")
 
-
-def _build_meta_prompt(text: str) -> str:
-    """Embed schema + paper text into the prompt template."""
-    schema_json = json.dumps(Paper.model_json_schema(), indent=2)
-    return (
-        _METADATA_PROMPT
-        .replace("{{SCHEMA}}", schema_json)
-        .replace("{{PAPER_TEXT}}", text[:16_000])  # keep prompt inside token budget
+# Schemas are serialised and the static instructions rendered once at import,
+# so every request shares a byte-identical system prefix (OpenAI prompt cache).
+_PAPER_SCHEMA_JSON = orjson.dumps(model_json_schema(Paper), option=orjson.OPT_INDENT_2).decode()
+_CPA_SCHEMA_JSON = orjson.dumps(model_json_schema(CPAPaperData), option=orjson.OPT_INDENT_2).decode()
+
+_META_PREFIX, _META_SUFFIX = split_prompt_template(_METADATA_PROMPT, _PAPER_SCHEMA_JSON)
+with open(PROMPT_PATH, encoding='utf-8') as fh:
+    _CPA_PREFIX, _CPA_SUFFIX = split_prompt_template(fh.read(), _CPA_SCHEMA_JSON)
+_OPENAI_MODEL = "gpt-4.1-mini-2025-04-14"
+_META_VERSION = prompt_version(_META_PREFIX, _META_SUFFIX)
+_CPA_VERSION = prompt_version(_CPA_PREFIX, _CPA_SUFFIX)
+
+# Schema-guided decoding, but not "strict": both models use optional/free-form
+# fields that strict mode rejects, so the schema is guidance only and an invalid
+# answer still gets one corrective retry with the validation errors.
+_META_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {"name": "paper_metadata", "schema": model_json_schema(Paper), "strict": False},
+}
+_CPA_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {"name": "cpa_paper_data", "schema": model_json_schema(CPAPaperData), "strict": False},
+}
+
+
+_META_CHAR_LIMIT = 16_000  # keep prompt inside token budget
+
+# Every column the metadata pass may fill. A single statement shape (NULL means "keep
+# the stored value") is prepared once per connection instead of re-planned per field set.
+_METADATA_COLUMNS = tuple(f for f in Paper.model_fields if f not in {"id", "md5_hash", "content_hash", "status"})
+_UPDATE_METADATA_SQL = sql.SQL("""
+    UPDATE papers
+       SET {}
+     WHERE md5_hash = ANY(%s)
+    RETURNING md5_hash, id;
+""").format(
+    sql.SQL(", ").join(
+        sql.SQL("{col} = COALESCE(%s, {col})").format(col=sql.Identifier(c)) for c in _METADATA_COLUMNS
     )
+)
 
 
-def _extract_metadata(fulltext: str) -> Dict[str, Any] | None:
-    """GPT‑4, validate against Paper schema, retry once if invalid."""
-    base_prompt = _build_meta_prompt(fulltext)
-    messages: List[Dict[str, str]] = [{"role": "user", "content": base_prompt}]
+def _build_meta_messages(text: str) -> List[Dict[str, str]]:
+    """Static prefix as system message, (already truncated) paper text as the user message."""
+    return [
+        {"role": "system", "content": _META_PREFIX},
+        {"role": "user", "content": text + _META_SUFFIX},
+    ]
 
-    for attempt in (1, 2):
+def _correction_request(err: Exception) -> str:
+    return (
+        "The JSON you provided did not pass validation. "
+        "Here are the problems:\n"
+        f"{err}\n"
+        "Please correct the JSON and return ONLY the corrected JSON object."
+    )
+
+def _extract_metadata(fulltext: str) -> Paper | None:
+    """GPT‑4, schema-guided, validated as a Paper; one corrective retry on invalid output."""
+    cached = get_cached_extraction(fulltext, _OPENAI_MODEL, _META_VERSION)
+    if cached is not None:
+        try:
+            return Paper.model_validate(cached)
+        except ValidationError as e:
+            print("[ERROR] Validation failure while updating metadata:", e)
+            return None
+    messages = _build_meta_messages(fulltext)
+    for attempt in (1, 2):  # one corrective retry: the schema is guidance, not enforced
         try:
             resp = client.chat.completions.create(
-                model="gpt-4.1-mini-2025-04-14",
+                model=_OPENAI_MODEL,
                 messages=messages,
                 temperature=0,
-                response_format={"type": "json_object"},
+                response_format=_META_RESPONSE_FORMAT,
             )
             raw_content = resp.choices[0].message.content
         except Exception as e:
             print("[ERROR] OpenAI API failed:", e)
             return None
 
-        # Normalise content → dict
-        content_str = raw_content if isinstance(raw_content, str) else json.dumps(raw_content)
-        if "clean_json_response" in globals():
-            content_str = clean_json_response(content_str)
-
         try:
-            data_dict = json.loads(content_str)
-        except json.JSONDecodeError as json_err:
-            validation_exc = json_err
-            data_dict = None
-        else:
-            try:
-                # Validate (will coerce types & drop extras)
-                Paper.model_validate(data_dict)
-                return data_dict
-            except ValidationError as verr:
-                validation_exc = verr
-
-        # Retry path
-        if attempt == 1:
-            err_msg = (
-                "The JSON failed validation with these errors:\n"
-                f"{validation_exc}\n"
-                "Please fix the JSON and return ONLY the corrected object."
-            )
-            messages.append({"role": "assistant", "content": raw_content})
-            messages.append({"role": "user", "content": err_msg})
-            continue
-
-        print("[ERROR] Metadata validation failed after second attempt:", validation_exc)
-        return None
-
-def update_metadata_from_fulltext(md5_hashes: str | Sequence[str], ocr_response: Any) -> None:
+            data_dict = orjson.loads(clean_json_response(raw_content or ""))
+            paper_obj = Paper.model_validate(data_dict)
+            break
+        except (orjson.JSONDecodeError, ValidationError) as e:
+            if attempt == 2:
+                print("[ERROR] Metadata validation failed after retry:", e)
+                return None
+            messages = [
+                *messages,
+                {"role": "assistant", "content": raw_content or ""},
+                {"role": "user", "content": _correction_request(e)},
+            ]
+    store_cached_extraction(fulltext, _OPENAI_MODEL, _META_VERSION, data_dict)
+    return paper_obj
+
+def update_metadata_from_fulltext(md5_hashes: str | Sequence[str], fulltext: str) -> None:
     if isinstance(md5_hashes, str):
         md5_hashes = [md5_hashes]
+    md5_hashes = list(md5_hashes)
+    if not md5_hashes:
+        return None
 
-    for md5 in md5_hashes:
-        paper_id = _update_single_metadata(md5, ocr_response)
-    return paper_id
-
-def _update_single_metadata(md5_hash: str, ocr_response: Any) -> None:
-    paper_fulltext = (
-            ocr_response
-            if isinstance(ocr_response, str)
-            else "\n\n".join(p.markdown for p in ocr_response.pages)
-        )
-    extracted = _extract_metadata(paper_fulltext)
-    if not extracted:
-        print(f"[WARN] Could not extract metadata for {md5_hash}; leaving row unchanged.")
-        return
+    # Metadata depends only on *fulltext*: extract and validate once, before
+    # any connection is taken, so none sits idle in transaction during the LLM call.
+    paper_obj = _extract_metadata(fulltext[:_META_CHAR_LIMIT])
+    if paper_obj is None:
+        print(f"[WARN] Could not extract metadata for {', '.join(md5_hashes)}; leaving rows unchanged.")
+        return None
 
-# -------- 3. pydantic validation ------------------------------
-    try:
-        paper_obj = Paper.model_validate(extracted)
-    except ValidationError as err:
-        print("[ERROR] Validation failure while updating metadata:", err)
-        return _get_paper_id(md5_hash)
-
-    # -------- 4. dynamic UPDATE only on changed / present fields --
-    columns, values = [], []
-    for field in paper_obj.model_fields_set:
-        if field in {"id", "md5_hash", "status"}:
-            continue
-        value = getattr(paper_obj, field)
-        if value is None:
-            continue
-        columns.append(f"{field} = %s")
-        values.append(json.dumps(value) if field == "authors_json" else value)
-
-    if columns:
-        sql = f"""
-            UPDATE papers
-               SET {', '.join(columns)}
-             WHERE md5_hash = %s
-            RETURNING id;          -- <-- RETURNING goes here, inside the query
-        """
+    # one connection, one UPDATE and one commit for every hash in the call
+    with cursor_ctx(commit=True) as cur:
+        return _update_metadata(md5_hashes, paper_obj, cur)
 
-        values.append(md5_hash)
+def _update_metadata(md5_hashes: List[str], paper_obj: Paper, cur) -> None:
+    """Write the extracted metadata to every hash with one UPDATE."""
+    # -------- fixed UPDATE; NULL keeps the stored value --------
+    values = []
+    for field in _METADATA_COLUMNS:
+        value = getattr(paper_obj, field) if field in paper_obj.model_fields_set else None
+        values.append(orjson.dumps(value).decode() if isinstance(value, dict) else value)
 
-        with cursor_ctx(commit=True) as cur:
-            cur.execute(sql, tuple(values))
-            paper_id = cur.fetchone()["id"]        # fetch the UUID you just returned
+    if any(v is not None for v in values):
+        cur.execute(_UPDATE_METADATA_SQL, (*values, md5_hashes), prepare=True)
+        paper_ids = {r["md5_hash"]: r["id"] for r in cur.fetchall()}
 
+        for md5_hash in md5_hashes:
             log.info("metadata updated for %s", md5_hash)
-            log.info("paper_id fetched for %s → %s", md5_hash, paper_id)
-            return paper_id
+            log.info("paper_id fetched for %s → %s", md5_hash, paper_ids.get(md5_hash))
+        return paper_ids.get(md5_hashes[-1])
     else:
-        log.info("no new metadata for %s", md5_hash)
+        log.info("no new metadata for %s", ", ".join(md5_hashes))
         return None
 
 def _get_paper_id(md5_hash: str, cur) -> str | None:
@@ -179,6 +198,7 @@ def add_paper_to_db(paper: Paper, cur):
                     """
                     INSERT INTO papers (
                         md5_hash,
+                        content_hash,
                         file_s3_uri,
                         fulltext_s3_uri,
                         file_size_bytes,
@@ -186,10 +206,11 @@ def add_paper_to_db(paper: Paper, cur):
                         source,
                         created_at
                     )
-                    VALUES (%s, %s, %s, %s, %s, %s, %s);
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s);
                     """,
                     (
                         paper.md5_hash.strip(),
+                        paper.content_hash,
                         paper.file_s3_uri,
                         paper.fulltext_s3_uri,
                         paper.file_size_bytes,
@@ -206,92 +227,65 @@ def _stream_s3_text(uri: str) -> str:
     if not uri.startswith(prefix):
         raise ValueError(f"URI must start with {prefix!r}")
     key = uri[len(prefix):]
-    obj = s3.get_object(Bucket=_S3_TARGET_BUCKET, Key=key)
-    return obj["Body"].read().decode()
+    return read_s3_text(s3, _S3_TARGET_BUCKET, key)
 
-def _build_prompt(paper_text: str) -> str:
-    with open(PROMPT_PATH, encoding='utf-8') as fh:
-        PROMPT_TEMPLATE = fh.read()
-    schema_json = json.dumps(CPAPaperData.model_json_schema(), indent=2)
-    prompt = PROMPT_TEMPLATE.replace("{{PAPER_TEXT}}", paper_text)
-    prompt = prompt.replace("{{SCHEMA}}", schema_json)
-    return prompt
+def _build_messages(paper_text: str) -> List[Dict[str, str]]:
+    return [
+        {"role": "system", "content": _CPA_PREFIX},
+        {"role": "user", "content": paper_text + _CPA_SUFFIX},
+    ]
 
 def _extract(paper_text: str) -> dict | None:
-    """Send the extraction prompt and, if validation fails, give the
-    validation errors back to the model for one corrective attempt."""
-
-    base_prompt = _build_prompt(paper_text)
-    messages = [{"role": "user", "content": base_prompt}]
+    """Schema-guided call validated locally; one corrective retry on invalid output."""
 
-    for attempt in (1, 2, 3):  # max three tries
+    cached = get_cached_extraction(paper_text, _OPENAI_MODEL, _CPA_VERSION)
+    if cached is not None:
+        return cached
+    messages = _build_messages(paper_text)
+    for attempt in (1, 2):  # one corrective retry: the schema is guidance, not enforced
         try:
             resp = client.chat.completions.create(
-                model="gpt-4.1-mini-2025-04-14",
+                model=_OPENAI_MODEL,
                 messages=messages,
                 temperature=0,
-                response_format={"type": "json_object"},
+                response_format=_CPA_RESPONSE_FORMAT,
             )
             raw = resp.choices[0].message.content
         except Exception as e:
             print("[ERROR] OpenAI API failed:", e)
             return None
 
-        # Clean and parse
-        content_str = raw if isinstance(raw, str) else json.dumps(raw)
-        if "clean_json_response" in globals():
-            content_str = clean_json_response(content_str)
-
         try:
-            data_dict = json.loads(content_str)
-        except json.JSONDecodeError as jerr:
-            # If JSON cannot even be parsed, treat as validation error path
-            data_dict = None
-            validation_exc = jerr
-        else:
-            try:
-                CPAPaperData.model_validate(data_dict)
-                # Success — return normalized JSON with aliases
-                return json.loads(
-                    CPAPaperData.model_validate(data_dict).model_dump_json(by_alias=True)
-                )
-            except ValidationError as verr:
-                validation_exc = verr
-
-        # If we reach here there was a validation / parsing problem.
-        if attempt == 1:
-            # Feed the errors back for a second attempt.
-            err_text = (
-                "The JSON you provided did not pass validation. "
-                "Here are the problems:\n"
-                f"{validation_exc}\n"
-                "Please correct the JSON and return ONLY the corrected JSON object."
-            )
-            # Record model's previous (invalid) answer so it has context
-            messages.append({"role": "assistant", "content": raw})
-            # Ask model to fix
-            messages.append({"role": "user", "content": err_text})
-            continue  # second loop iteration
-        elif attempt == 2:
-            # Feed the errors back for a second attempt.
-            err_text = (
-                "The JSON you provided did not pass validation. "
-                "Here are the problems:\n"
-                f"{validation_exc}\n"
-                "Please correct the JSON and return ONLY the corrected JSON object."
-            )
-            # Record model's previous (invalid) answer so it has context
-            messages.append({"role": "assistant", "content": raw})
-            # Ask model to fix
-            messages.append({"role": "user", "content": err_text})
-            continue  # second loop iteration
-        else:
-            # Second attempt also failed
-            print("[ERROR] Validation/JSON error after retry:", validation_exc)
-            return None
-
-
-def get_cpa_facts_from_fulltext(file_md5_hash: str | None = None, limit: int = 100) -> None:
+            data_dict = orjson.loads(clean_json_response(raw or ""))
+            # Normalised, JSON-safe dict with aliases
+            result = CPAPaperData.model_validate(data_dict).model_dump(mode="json", by_alias=True)
+            break
+        except (orjson.JSONDecodeError, ValidationError) as e:
+            if attempt == 2:
+                print("[ERROR] Validation/JSON error after retry:", e)
+                return None
+            # Feed the errors back, with the invalid answer for context
+            messages = [
+                *messages,
+                {"role": "assistant", "content": raw or ""},
+                {"role": "user", "content": _correction_request(e)},
+            ]
+    store_cached_extraction(paper_text, _OPENAI_MODEL, _CPA_VERSION, result)
+    return result
+
+
+def _process_paper(paper_id: str, uri: str) -> tuple[str, dict | None]:
+    print(f"[TRACE] Extracting CPAs from {uri} …")
+    try:
+        return paper_id, _extract(_stream_s3_text(uri))
+    except Exception as e:
+        # one unreadable paper must not discard the rest of the batch
+        print(f"[ERROR] CPA extraction failed for {uri}: {e}")
+        return paper_id, None
+
+def get_cpa_facts_from_fulltext(
+    file_md5_hash: str | None = None, limit: int = 100, max_workers: int = DEFAULT_MAX_WORKERS
+) -> None:
     if file_md5_hash:
         query = """
             SELECT id, fulltext_s3_uri
@@ -325,25 +319,27 @@ def get_cpa_facts_from_fulltext(file_md5_hash: str | None = None, limit: int = 1
         print(msg)
         return
 
-    done = 0
-    for row in rows:
-        if not row:
-            continue
-        paper_id, uri = row
-        print(f"[TRACE] Extracting CPAs from {uri} …")
-        parsed = _extract(_stream_s3_text(uri))
-        if not parsed:
-            print("[WARN] Extraction failed; marking FAILED")
-            with cursor_ctx(commit=True) as cur:
-                cur.execute("UPDATE papers SET status='FAILED' WHERE id=%s;", (paper_id,))
-            return "FAILED"
-        with cursor_ctx(commit=True) as cur:
-            cur.execute(
+    # S3 read + LLM call per paper in worker threads, at most max_workers at a time
+    results = run_bounded(
+        _process_paper,
+        ((row["id"], row["fulltext_s3_uri"]) for row in rows if row),
+        max_workers,
+    )
+    completed = [(orjson.dumps(parsed).decode(), paper_id) for paper_id, parsed in results if parsed]
+    failed = [(paper_id,) for paper_id, parsed in results if not parsed]
+    for (paper_id,) in failed:
+        print(f"[WARN] Extraction failed for {paper_id}; marking FAILED")
+
+    # one transaction for everything this call produced
+    with cursor_ctx(commit=True) as cur:
+        if completed:
+            cur.executemany(
                 "UPDATE papers SET cpa_facts_json=%s, status='COMPLETED' WHERE id=%s;",
-                (json.dumps(parsed), paper_id),
+                completed,
             )
-        done += 1
-        print("[TRACE] Paper updated and marked COMPLETED.")
-
-    print(f"[TRACE] {done}/{len(rows)} papers updated." if not single_paper else "[TRACE] Done.")
+        if failed:
+            cur.executemany("UPDATE papers SET status='FAILED' WHERE id=%s;", failed)
+    if failed:
+        return "FAILED"
 
+    print(f"[TRACE] {len(completed)}/{len(rows)} papers updated." if not single_paper else "[TRACE] Done.")
@@ -1,6 +1,7 @@
-import re
-from typing import List
+from psycopg import sql
+from pipelines.ingest.staging import json_copy_line
 from uuid import UUID
+from pgvector import Vector
 from pipelines.utils.embeddings import get_embedding
 from distiller.schemas.papers import PaperStatus
 import logging
@@ -9,22 +10,41 @@ SIMILARITY_THRESHOLD = 0.38
 
 # ────────────────────────── alias helpers ──────────────────────────
 
-_INCHI_PAT  = re.compile(r"^[A-Z]{14}-[A-Z]{10}-[A-Z]$", re.I)
+# Ordered on the halfvec expression so idx_alias_embedding_ann (HNSW) is used;
+# `dist` stays full precision for the threshold check.
 _EMBED_SQL  = """
-SELECT id, chemical_id, alias, embedding <-> %s::vector AS dist
+SELECT id, chemical_id, alias, embedding <-> %(v)s::vector AS dist
 FROM   cpa_chemical_aliases
-ORDER  BY dist
+ORDER  BY embedding::halfvec(3072) <-> %(v)s::vector::halfvec(3072)
 LIMIT  1;
 """
 
+# (inchikey, label) pairs -> chemical and, when present, the matching alias
+_BULK_INCHIKEY_SQL = """
+SELECT k.inchikey, k.alias, c.id AS chemical_id, a.id AS alias_id
+FROM   unnest(%s::text[], %s::text[]) AS k(inchikey, alias)
+JOIN   cpa_chemicals c ON c.inchikey = k.inchikey
+LEFT   JOIN cpa_chemical_aliases a
+       ON a.chemical_id = c.id AND a.alias = k.alias;
+"""
+
 def _is_inchikey(k: str | None) -> bool:
-    return bool(k and _INCHI_PAT.match(k))
+    """14-10-1 blocks of ASCII letters (either case), checked without the regex engine."""
+    return bool(
+        k
+        and len(k) == 27
+        and k[14] == "-"
+        and k[25] == "-"
+        and k.count("-") == 2
+        and k.isascii()
+        and k.replace("-", "").isalpha()
+    )
 
 def _canon(txt: str) -> str:
     return txt.strip().lower()
 
 def _ensure_alias(
-    cur, *, chemical_id: UUID, label: str, emb: List[float]
+    cur, *, chemical_id: UUID, label: str, emb: Vector
 ) -> UUID:
     """Insert the label as a new alias (or refresh the embedding)."""
     cur.execute(
@@ -36,6 +56,7 @@ def _ensure_alias(
         RETURNING id;
         """,
         (chemical_id, label, emb),
+        prepare=True,
     )
     return cur.fetchone()["id"]
 
@@ -50,7 +71,7 @@ def resolve_alias_id(
     """
     # 1️⃣  direct InChIKey
     if _is_inchikey(inchikey):
-        cur.execute("SELECT id FROM cpa_chemicals WHERE inchikey = %s;", (inchikey,))
+        cur.execute("SELECT id FROM cpa_chemicals WHERE inchikey = %s;", (inchikey,), prepare=True)
         row = cur.fetchone()
         if row:
             chem_id = row["id"]
@@ -59,33 +80,65 @@ def resolve_alias_id(
                 "SELECT id FROM cpa_chemical_aliases "
                 "WHERE chemical_id = %s AND alias = %s;",
                 (chem_id, label),
+                prepare=True,
             )
             alias_row = cur.fetchone()
             if alias_row:
                 return alias_row["id"], chem_id   # alias already present
 
             # create missing alias
-            emb = get_embedding(_canon(label))
+            emb = Vector(get_embedding(_canon(label)))
             alias_id = _ensure_alias(cur, chemical_id=chem_id, label=label, emb=emb)
             return alias_id, chem_id
 
     # 2️⃣  embedding search
-    vec = get_embedding(_canon(label))
-    cur.execute(_EMBED_SQL, (vec,))
+    return nearest_alias_id(cur, label=label)
+
+def nearest_alias_id(cur, *, label: str) -> tuple[UUID | None, UUID | None]:
+    """(alias_id, chemical_id) of the closest alias within SIMILARITY_THRESHOLD, else (None, None)."""
+    vec = Vector(get_embedding(_canon(label)))
+    cur.execute(_EMBED_SQL, {"v": vec}, prepare=True)
     row = cur.fetchone()
     if row and row["dist"] < SIMILARITY_THRESHOLD:
         return row["id"], row["chemical_id"]
 
     return None, None   # not found
 
+def bulk_resolve(
+    cur, pairs: list[tuple[str | None, str]]
+) -> dict[tuple[str, str], tuple[UUID, UUID]]:
+    """
+    InChIKey fast path of `resolve_alias_id` for many (inchikey, label) pairs
+    in one query. Returns only the pairs whose InChIKey is known, creating
+    missing aliases; the caller falls back to `nearest_alias_id` for the rest.
+    """
+    keyed = list(dict.fromkeys((k, label) for k, label in pairs if _is_inchikey(k)))
+    if not keyed:
+        return {}
+    cur.execute(
+        _BULK_INCHIKEY_SQL,
+        ([k for k, _ in keyed], [label for _, label in keyed]),
+    )
+    out: dict[tuple[str, str], tuple[UUID, UUID]] = {}
+    for row in cur.fetchall():
+        alias_id = row["alias_id"]
+        if alias_id is None:
+            emb = Vector(get_embedding(_canon(row["alias"])))
+            alias_id = _ensure_alias(
+                cur, chemical_id=row["chemical_id"], label=row["alias"], emb=emb
+            )
+        out[(row["inchikey"], row["alias"])] = (alias_id, row["chemical_id"])
+    return out
+
 def stage_and_merge(stage_table: str, rows: list[dict], merge_fn: str):
     if not rows:
         return []
     with cursor_ctx(commit=True) as cur:
         # 1. COPY rows into the staging table (as JSONB)
-        tmp_json = [json.dumps(r) for r in rows]
-        cur.copy_from(io.StringIO("\n".join(tmp_json)),
-                      stage_table, columns=("data_json",))
+        stmt = sql.SQL("COPY {} (data_json) FROM STDIN").format(sql.Identifier(stage_table))
+        with cur.copy(stmt) as copy:
+            for r in rows:
+                copy.write(json_copy_line(r))
 
         # 2. Call the merge function; it returns (json_id, live_table_id)
         cur.execute(f"SELECT * FROM {merge_fn}();")